@@ -0,0 +1,216 @@
+"""
+Caching with explicit keys and memory budgets for the example apps.
+
+st.cache hashes a function's arguments on every call, and unless
+allow_output_mutation is set it hashes the result too, so reruns pay for
+hashing large DataFrames and models. Here each cache takes a key function
+that builds a cheap key instead:
+
+    @cached("weather_data", key=file_key, max_mb=4096)
+    def read_data(path):
+        ...
+
+Keys are usually built with `file_key` (path, size and modification time),
+`params_key` (a hyperparameter dict) or `mask_digest` (a boolean row mask).
+When a cache goes over its memory budget, the least recently used entries
+are dropped. Cached values are shared, not copied, so treat them as read-only
+unless that sharing is the point.
+"""
+import os
+import sys
+import pickle
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+_caches = {}
+_caches_lock = threading.Lock()
+_MISSING = object()
+
+
+
+class BudgetCache:
+    """
+    A least-recently-used cache holding at most `max_mb` megabytes.
+
+    Parameters
+    ----------
+    name : string
+    max_mb : number
+        Memory budget. The newest entry is always kept, even if it is
+        bigger than the budget on its own.
+    """
+
+    def __init__(self, name, max_mb):
+        self.name = name
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """ The value cached under key, marking it as recently used """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes=None):
+        """ Cache value under key, then evict until within budget """
+        nbytes = estimate_size(value) if nbytes is None else nbytes
+        with self._lock:
+            self.pop(key)
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._bytes -= dropped
+                self.evictions += 1
+        return value
+
+    def pop(self, key, default=None):
+        """ Remove key and return its value """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, nbytes = self._entries.pop(key)
+            self._bytes -= nbytes
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """ Entry count, memory use and hit counts """
+        return {"entries": len(self._entries),
+                "used_mb": self._bytes / 1024 ** 2,
+                "budget_mb": self.max_bytes / 1024 ** 2,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+
+def get_cache(name, max_mb=None):
+    """
+    The cache called `name`, created on first use with a budget of max_mb
+    (default 256 MB). It lives as long as the server process, across
+    reruns. Passing max_mb for an existing cache changes its budget, taking
+    effect on the next put; leaving it out keeps the budget as it is.
+    """
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = BudgetCache(name, 256 if max_mb is None
+                                        else max_mb)
+        cache = _caches[name]
+    if max_mb is not None:
+        cache.max_bytes = int(max_mb * 1024 ** 2)
+    return cache
+
+
+def cache_stats():
+    """ Stats of every cache as a DataFrame """
+    return pd.DataFrame({name: cache.stats() for name, cache
+                         in _caches.items()}).T
+
+
+def cached(name, key, max_mb=256):
+    """
+    Decorator caching a function's results under an explicit key.
+
+    Parameters
+    ----------
+    name : string
+        Name of the cache, unique within the server process
+    key : callable
+        Called with the function's arguments; returns a hashable key that
+        changes whenever the result would
+    max_mb : number
+        Memory budget of the cache
+    """
+    def decorator(func):
+        store = get_cache(name, max_mb)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            value = store.get(cache_key, _MISSING)
+            if value is _MISSING:
+                value = store.put(cache_key, func(*args, **kwargs))
+            return value
+        wrapper.cache = store
+        return wrapper
+    return decorator
+
+
+### Keys
+def file_key(path):
+    """ Key for data read from a file: its path, size and modified time """
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def params_key(parameters):
+    """ Key for a model: its hyperparameters as a sorted tuple """
+    return tuple(sorted(parameters.items()))
+
+
+def mask_digest(mask):
+    """
+    Short digest of a boolean row mask. Compute it once when the mask
+    changes and use it in keys; None (no mask) is "all".
+    """
+    if mask is None:
+        return "all"
+    packed = np.packbits(mask)
+    return hashlib.blake2b(packed, digest_size=16).hexdigest()
+
+
+
+### Sizes
+def estimate_size(obj, _seen=None):
+    """
+    Rough number of bytes an object keeps in memory. Frames and arrays are
+    measured from their buffers without inspecting each value; memory-mapped
+    arrays count as nothing since the OS can page them out.
+    """
+    _seen = set() if _seen is None else _seen
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, np.memmap):
+        return 0
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(np.sum(obj.memory_usage(index=True, deep=False)))
+    if isinstance(obj, (str, bytes)):
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sum(estimate_size(k, _seen) + estimate_size(v, _seen)
+                   for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sum(estimate_size(v, _seen) for v in obj)
+    if hasattr(obj, "__dict__"):
+        return estimate_size(vars(obj), _seen)
+    try:
+        # Compiled objects such as sklearn's trees only expose their size
+        # through pickling; this runs once, when the value is cached
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(obj)
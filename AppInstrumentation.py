@@ -0,0 +1,245 @@
+"""
+Lightweight timing for the example apps.
+
+Wrap the expensive parts of an app in `stage` blocks or `timed` decorators,
+then call `session_recorder().start_rerun()` at the top of the app's main
+function. Each session's reruns are collected by its own recorder and can be
+shown with `show_panel` (when DEBUG_PANEL is set) or exported as JSON. The
+active recorder is kept per thread, since Streamlit runs each session's
+script in its own thread. While no recorder is active the wrappers only
+check a thread-local variable, so they cost next to nothing.
+"""
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import contextlib
+from collections import deque, OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+from AppCaching import cache_stats
+
+# Show the debug panel when the app is started with APP_DEBUG_PANEL=1
+DEBUG_PANEL = os.environ.get("APP_DEBUG_PANEL", "") not in ["", "0"]
+
+# The recorder collecting timings for this thread's rerun (None when off)
+_local = threading.local()
+_NOT_RECORDING = contextlib.nullcontext()
+
+# Recorders by session id, for Streamlit versions without session_state
+_recorders = OrderedDict()
+_recorders_lock = threading.Lock()
+MAX_SESSIONS = 100
+
+
+
+class Recorder:
+    """
+    Collects per-stage timings for each rerun of one session. Get the
+    calling session's recorder with `session_recorder`.
+
+    Parameters
+    ----------
+    max_reruns : integer
+        Number of past reruns to keep
+    """
+
+    def __init__(self, max_reruns=100):
+        self.enabled = False
+        self.profile_next = False
+        self.profile_text = None
+        self.reruns = deque(maxlen=max_reruns)
+        self._current = None
+        self._profiler = None
+
+    def start_rerun(self):
+        """ Start timing a new rerun; call at the top of the app """
+        self.end_rerun()
+        if not self.enabled:
+            _local.recorder = None
+            return
+        self._current = {"started": time.time(), "total_s": None,
+                         "stages": [], "_start": time.perf_counter()}
+        _local.recorder = self
+        if self.profile_next:
+            self.profile_next = False
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def end_rerun(self):
+        """ Finish timing the current rerun, if there is one """
+        if self._profiler is not None:
+            self._profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats(
+                "cumulative").print_stats(40)
+            self.profile_text = out.getvalue()
+            self._profiler = None
+        if self._current is not None:
+            current = self._current
+            current["total_s"] = time.perf_counter() - current.pop("_start")
+            self.reruns.append(current)
+            self._current = None
+        if getattr(_local, "recorder", None) is self:
+            _local.recorder = None
+
+    def add(self, name, seconds):
+        """ Record that stage `name` took `seconds` in the current rerun """
+        if self._current is not None:
+            self._current["stages"].append({"name": name,
+                                            "seconds": seconds})
+
+    def last_rerun(self):
+        """ Stage timings of the latest finished rerun as a DataFrame """
+        if not self.reruns:
+            return pd.DataFrame(columns=["stage", "seconds"])
+        stages = self.reruns[-1]["stages"]
+        return (pd.DataFrame(stages, columns=["name", "seconds"])
+                  .groupby("name", sort=False)["seconds"].sum()
+                  .rename_axis("stage").reset_index())
+
+    def summary(self):
+        """ Calls, total, mean and max time per stage over all reruns """
+        stages = [s for rerun in self.reruns for s in rerun["stages"]]
+        if not stages:
+            return pd.DataFrame(columns=["calls", "total", "mean", "max"])
+        summary = (pd.DataFrame(stages).groupby("name")["seconds"]
+                     .agg(["count", "sum", "mean", "max"]))
+        summary.columns = ["calls", "total", "mean", "max"]
+        return summary.sort_values("total", ascending=False)
+
+    def to_json(self):
+        """ All kept reruns and the per-stage summary as a JSON string """
+        return json.dumps({"reruns": list(self.reruns),
+                           "summary": self.summary().T.to_dict()}, indent=2)
+
+
+
+def session_recorder():
+    """ The Recorder of the session running this script, made on first use """
+    if hasattr(st, "session_state"):
+        if "_timings_recorder" not in st.session_state:
+            st.session_state["_timings_recorder"] = Recorder()
+        return st.session_state["_timings_recorder"]
+
+    from streamlit.report_thread import get_report_ctx  # streamlit < 0.84
+    ctx = get_report_ctx()
+    session_id = ctx.session_id if ctx is not None else None
+    with _recorders_lock:
+        if session_id not in _recorders:
+            _recorders[session_id] = Recorder()
+            if len(_recorders) > MAX_SESSIONS:
+                _recorders.popitem(last=False)  # the oldest session's
+        return _recorders[session_id]
+
+
+
+### Timing helpers
+class _Stage:
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.recorder.add(self.name, time.perf_counter() - self.start)
+
+
+def stage(name):
+    """
+    Context manager timing a block of code as stage `name`.
+
+    Example
+    -------
+    with stage("fit"):
+        model.fit(X, y)
+    """
+    recorder = getattr(_local, "recorder", None)
+    if recorder is None:
+        return _NOT_RECORDING
+    return _Stage(recorder, name)
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function as one stage. Put it above
+    @st.cache to include the cache lookup in the timing.
+
+    Parameters
+    ----------
+    name : string, optional
+        Stage name, defaults to the function's name
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = getattr(_local, "recorder", None)
+            if recorder is None:
+                return func(*args, **kwargs)
+            with _Stage(recorder, stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+
+### Debug panel
+def show_panel(recorder, container):
+    """
+    Finish the current rerun and show the timings, and the caches' memory
+    use and hit counts, in a Streamlit container, e.g. `st.sidebar`. Call at
+    the end of the app's main function.
+    """
+    recorder.end_rerun()
+    panel = container.beta_expander("Debug: Timings", expanded=False)
+    enabled = panel.checkbox("Record timings", value=recorder.enabled)
+    if enabled != recorder.enabled:
+        recorder.enabled = enabled
+        recorder.reruns.clear()
+    if not recorder.enabled:
+        panel.write("Turn on to time each stage of every rerun.")
+        show_caches(panel)
+        return
+
+    if recorder.reruns:
+        total = recorder.reruns[-1]["total_s"]
+        panel.markdown(f"**Last rerun:** {total:.3f} s")
+        panel.table(recorder.last_rerun().set_index("stage")
+                                         .style.format("{:.4f}"))
+        panel.markdown(f"**This session:** {len(recorder.reruns)} reruns")
+        panel.table(recorder.summary().style.format(
+            {"total": "{:.4f}", "mean": "{:.4f}", "max": "{:.4f}"}))
+
+    if panel.button("Profile the next rerun"):
+        recorder.profile_next = True
+    if recorder.profile_text:
+        panel.text(recorder.profile_text)
+
+    if hasattr(panel, "download_button"):
+        panel.download_button("Download timings (JSON)", recorder.to_json(),
+                              file_name="timings.json")
+    elif panel.checkbox("Show timings as JSON"):
+        panel.code(recorder.to_json(), language="json")
+    show_caches(panel)
+
+
+def show_caches(container):
+    """
+    Entries, memory use against budget, hits, misses and evictions of every
+    AppCaching cache, for tuning their budgets
+    """
+    caches = cache_stats()
+    if len(caches):
+        container.markdown("**Caches:**")
+        container.table(caches.style.format("{:.0f}").format(
+            "{:.1f}", subset=["used_mb", "budget_mb"]))
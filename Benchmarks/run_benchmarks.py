@@ -0,0 +1,518 @@
+"""
+Headless benchmarks for the example apps.
+
+Each benchmark calls the apps' functions directly (no Streamlit server) on
+synthetic data at several scales, in its own process, and records wall time,
+peak resident memory and the size of what it produced.
+
+    python run_benchmarks.py run --scales 1 10 100 --output results.json
+    python run_benchmarks.py compare results.json baseline.json
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import runpy
+import inspect
+import shutil
+import subprocess
+import argparse
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+from queue import Empty
+from importlib import metadata
+
+import synthetic_data
+
+ROOT = synthetic_data.ROOT
+WINE_DIR = os.path.join(ROOT, "Data_Exploration")
+WEATHER_DIR = os.path.join(ROOT, "Machine_Learning")
+CLEAN_SCRIPT = os.path.join(WEATHER_DIR, "WeatherData", "clean_aus_weather.py")
+sys.path[:0] = [WINE_DIR, WEATHER_DIR]
+
+BENCHMARKS = {}
+
+
+
+### Data sets, written once per scale and shared by the benchmarks
+def make_weather_raw(path, scale):
+    """ weatherAUS.csv and the station coordinates, for the cleaning script """
+    n_rows = synthetic_data.WEATHER_ROWS * scale
+    synthetic_data.write_csv(synthetic_data.weather_aus_chunks(n_rows),
+                             os.path.join(path, "weatherAUS.csv"))
+    synthetic_data.stations(n_rows).to_json(
+        os.path.join(path, "australian_cities.json"), orient="index")
+
+
+def make_weather_clean(path, scale):
+    """ WeatherData/cleaned_weather.csv, as the weather app expects it """
+    os.makedirs(os.path.join(path, "WeatherData"))
+    synthetic_data.cleaned_weather(synthetic_data.WEATHER_ROWS * scale).to_csv(
+        os.path.join(path, "WeatherData", "cleaned_weather.csv"), index=False)
+
+
+def make_wine(path, scale):
+    """ Wine column files for the explorer's memory-mapped data source """
+    n_rows = synthetic_data.WINE_ROWS * scale
+    synthetic_data.write_npy(synthetic_data.wine_chunks(n_rows), path, n_rows)
+
+
+DATASETS = {"weather_raw": make_weather_raw,
+            "weather_clean": make_weather_clean,
+            "wine": make_wine}
+
+
+
+### Benchmarks
+def benchmark(name, dataset):
+    """
+    Register a benchmark. The function runs with the data set's directory as
+    its working directory and gets a `timed` context manager to wrap the
+    measured section in. It returns the size of its output in bytes, or a
+    dictionary with "payload_bytes" and any other numbers worth recording
+    (such as a model's accuracy).
+    """
+    def register(func):
+        BENCHMARKS[name] = {"dataset": dataset, "func": func}
+        return func
+    return register
+
+
+def uncached(func):
+    """ The function underneath st.cache, AppCaching and other decorators """
+    return inspect.unwrap(func)
+
+
+def weather_model():
+    """ A random forest with the app's default hyperparameters """
+    from sklearn.ensemble import RandomForestClassifier
+    return RandomForestClassifier(n_estimators=150, max_depth=7,
+        min_samples_split=2, max_features="sqrt", random_state=101)
+
+
+@benchmark("weather_clean", "weather_raw")
+def bench_weather_clean(timed):
+    with timed():
+        runpy.run_path(CLEAN_SCRIPT)
+    return os.path.getsize("cleaned_weather.csv")
+
+
+@benchmark("weather_load_data", "weather_clean")
+def bench_weather_load_data(timed):
+    import Weather_Prediction_App as app
+    with timed():
+        data = uncached(app.load_data)()
+    return sum(int(v.memory_usage(deep=True).sum()) if v.ndim == 2
+               else int(v.memory_usage(deep=True)) for v in data.values())
+
+
+def test_scores(model, data):
+    """ Testing accuracy and F1 score, to compare model types """
+    from AppModelFunctions import score
+    scores = score(data["y_test"], model.predict(data["X_test"]))
+    return {"test_accuracy": scores["accuracy"],
+            "test_f1": scores["f1 score"]}
+
+
+@benchmark("weather_train", "weather_clean")
+def bench_weather_train(timed):
+    import Weather_Prediction_App as app
+    data = uncached(app.load_data)()
+    model = weather_model()
+    with timed():
+        model.fit(data["X_train"], data["y_train"])
+    return {"payload_bytes": len(pickle.dumps(model)),
+            **test_scores(model, data)}
+
+
+@benchmark("weather_bin", "weather_clean")
+def bench_weather_bin(timed):
+    import Weather_Prediction_App as app
+    data = uncached(app.load_data)()
+    with timed():
+        binned = uncached(app.get_binned_data)(data)
+    return binned["X_train"].nbytes
+
+
+@benchmark("weather_train_hist", "weather_clean")
+def bench_weather_train_hist(timed):
+    import Weather_Prediction_App as app
+    from AppModelFunctions import make_model, BinnedModel
+    data = uncached(app.load_data)()
+    binned = app.get_binned_data(data)
+    model = make_model(app.DEFAULT_PARAMETERS, "hist")
+    with timed():
+        model.fit(binned["X_train"], data["y_train"])
+    return {"payload_bytes": len(pickle.dumps(model)),
+            **test_scores(BinnedModel(binned["binner"], model), data)}
+
+
+@benchmark("weather_train_hist_raw", "weather_clean")
+def bench_weather_train_hist_raw(timed):
+    import Weather_Prediction_App as app
+    from AppModelFunctions import make_model
+    data = uncached(app.load_data)()
+    model = make_model(app.DEFAULT_PARAMETERS, "hist")
+    with timed():
+        model.fit(data["X_train"], data["y_train"])
+    return {"payload_bytes": len(pickle.dumps(model)),
+            **test_scores(model, data)}
+
+
+@benchmark("weather_evaluate", "weather_clean")
+def bench_weather_evaluate(timed):
+    import Weather_Prediction_App as app
+    data = uncached(app.load_data)()
+    model = weather_model().fit(data["X_train"], data["y_train"])
+    with timed():
+        results, confusions = app.evaluate_model(model, data)
+    return len(pickle.dumps((results, confusions)))
+
+
+@benchmark("weather_cv", "weather_clean")
+def bench_weather_cv(timed):
+    import Weather_Prediction_App as app
+    data = uncached(app.load_data)()
+    parameters = dict(app.DEFAULT_PARAMETERS)
+    app.get_folds(data, 5)
+    with timed():
+        trained = app.train_model(parameters, data, n_folds=5)
+    return len(pickle.dumps(trained["model"]))
+
+
+@benchmark("weather_importance", "weather_clean")
+def bench_weather_importance(timed):
+    import Weather_Prediction_App as app
+    from AppModelFunctions import permutation_importance
+    data = uncached(app.load_data)()
+    model = weather_model().fit(data["X_train"], data["y_train"])
+    with timed():
+        importance = permutation_importance(model, data["X_test"],
+                                            data["y_test"])
+    return int(importance.memory_usage().sum())
+
+
+def app_env(**extra):
+    """ Environment for a fresh interpreter that can import both apps """
+    return dict(os.environ, **extra, PYTHONPATH=os.pathsep.join(
+        [WINE_DIR, WEATHER_DIR, os.environ.get("PYTHONPATH", "")]))
+
+
+def time_import(module):
+    """ Import an app module in a fresh interpreter, as a server would """
+    subprocess.run([sys.executable, "-c", f"import {module}"],
+                   env=app_env(), check=True)
+
+
+def time_first_run(script, **env):
+    """
+    Run an app's script as __main__ in a fresh interpreter: its imports and
+    a first main() with every cache empty, what the first visitor waits
+    for. Without a server the widgets return their defaults.
+    """
+    code = f"import runpy; runpy.run_path({script!r}, run_name='__main__')"
+    subprocess.run([sys.executable, "-c", code], env=app_env(**env),
+                   check=True)
+
+
+@benchmark("weather_import", "weather_clean")
+def bench_weather_import(timed):
+    with timed():
+        time_import("Weather_Prediction_App")
+    return 0
+
+
+@benchmark("wine_import", "wine")
+def bench_wine_import(timed):
+    with timed():
+        time_import("Wine_Data_App")
+    return 0
+
+
+@benchmark("weather_first_run", "weather_clean")
+def bench_weather_first_run(timed):
+    # The app reads its help text relative to the working directory
+    if not os.path.exists("raw"):
+        os.symlink(os.path.join(WEATHER_DIR, "raw"), "raw",
+                   target_is_directory=True)
+    with timed():
+        time_first_run(os.path.join(WEATHER_DIR,
+                                    "Weather_Prediction_App.py"))
+    return 0
+
+
+@benchmark("wine_first_run", "wine")
+def bench_wine_first_run(timed):
+    with timed():
+        time_first_run(os.path.join(WINE_DIR, "Wine_Data_App.py"),
+                       WINE_DATA_DIR=os.getcwd())
+    return 0
+
+
+@benchmark("wine_load_data", "wine")
+def bench_wine_load_data(timed):
+    import Wine_Data_App as app
+    os.environ["WINE_DATA_DIR"] = os.getcwd()
+    with timed():
+        source = uncached(app.load_data)()
+        stats = [source.column_stats(col) for col in source.columns]
+    return len(json.dumps(stats))
+
+
+@benchmark("wine_filter", "wine")
+def bench_wine_filter(timed):
+    import Wine_Data_App as app
+    from AppCaching import mask_digest
+    os.environ["WINE_DATA_DIR"] = os.getcwd()
+    source = app.load_data()
+    filters = {"alcohol": {"<": 14.0, ">": 12.5, "==": None, "active": True},
+               "hue": {"<": None, ">": 0.8, "==": None, "active": True}}
+    with timed():
+        mask = source.apply_filters(filters)
+        html = app.get_styled_table(source, mask, mask_digest(mask), 100,
+                                    "proline", False)
+    return mask.nbytes + len(html)
+
+
+@benchmark("wine_plots", "wine")
+def bench_wine_plots(timed):
+    import Wine_Data_App as app
+    os.environ["WINE_DATA_DIR"] = os.getcwd()
+    source = app.load_data()
+    cols = ["alcohol", "hue", "proline", "magnesium"]
+    with timed():
+        summaries = app.get_summaries(source, None, "all")
+        sample = source.sample(2000, cols + [source.target])
+        charts = [app.create_corrolation_plot(summaries["correlation"]),
+                  app.create_distribution_figure(summaries["distributions"],
+                      summaries["class_counts"], True),
+                  app.create_comparison_figure(sample,
+                      summaries["distributions"], cols, True, size=120)]
+        payload = sum(len(chart.to_json()) for chart in charts)
+    return payload
+
+
+
+### Measurement
+def reset_peak_rss():
+    """ Reset the peak RSS counter where the kernel allows it (Linux) """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory in megabytes of this process, or of a finished
+    child process if that was larger
+    """
+    import resource
+    unit = 1024 ** 2 if sys.platform == "darwin" else 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return max(int(line.split()[1]) / 1024, children)
+    except OSError:
+        pass
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+               children)
+
+
+def run_one(name, data_dir, queue):
+    """ Run a single benchmark; meant to be the target of a new process """
+    os.chdir(data_dir)
+    measured = {}
+
+    @contextlib.contextmanager
+    def timed():
+        reset_peak_rss()
+        start = time.perf_counter()
+        yield
+        measured["wall_time_s"] = time.perf_counter() - start
+        measured["peak_rss_mb"] = peak_rss_mb()
+
+    try:
+        output = BENCHMARKS[name]["func"](timed)
+        if not isinstance(output, dict):
+            output = {"payload_bytes": output}
+        measured.update(output)
+    except Exception as e:
+        measured["error"] = f"{type(e).__name__}: {e}"
+    queue.put(measured)
+
+
+def run(names, scales, workdir, repeat=1):
+    """
+    Run benchmarks at each scale. Each repeat runs in a fresh process; the
+    fastest wall time and largest peak memory are kept.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for scale in scales:
+        data_dirs = {}
+        for name in names:
+            dataset = BENCHMARKS[name]["dataset"]
+            if dataset not in data_dirs:
+                path = os.path.join(workdir, f"{dataset}_x{scale}")
+                if not os.path.exists(path):
+                    print(f"Generating {dataset} at scale {scale}")
+                    os.makedirs(path)
+                    DATASETS[dataset](path, scale)
+                data_dirs[dataset] = path
+
+        for name in names:
+            runs = []
+            for _ in range(repeat):
+                queue = ctx.Queue()
+                proc = ctx.Process(target=run_one, args=(name,
+                                   data_dirs[BENCHMARKS[name]["dataset"]],
+                                   queue))
+                proc.start()
+                proc.join()
+                try:
+                    runs.append(queue.get(timeout=1))
+                except Empty:
+                    runs.append({"error": f"exit code {proc.exitcode}"})
+            result = {"name": name, "scale": scale}
+            errors = [r["error"] for r in runs if "error" in r]
+            if errors:
+                result["error"] = errors[0]
+            else:
+                result.update(runs[0])
+                result.update(
+                    wall_time_s=min(r["wall_time_s"] for r in runs),
+                    peak_rss_mb=max(r["peak_rss_mb"] for r in runs))
+            print(format_result(result))
+            results.append(result)
+    return results
+
+
+def environment():
+    """ Versions of the things most likely to change a result """
+    versions = {}
+    for package in ["streamlit", "pandas", "numpy", "scikit-learn",
+                    "altair"]:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "packages": versions,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def format_result(result):
+    label = f"{result['name']:<24} x{result['scale']:<5}"
+    if "error" in result:
+        return f"{label} ERROR {result['error']}"
+    extras = [f"{k}={v:.4f}" for k, v in result.items() if k not in
+              ["name", "scale", "wall_time_s", "peak_rss_mb", "payload_bytes"]]
+    return " ".join([f"{label} {result['wall_time_s']:9.3f} s "
+                     f"{result['peak_rss_mb']:9.1f} MB "
+                     f"{result['payload_bytes'] / 1024:11.1f} KB"] + extras)
+
+
+
+### Comparing runs
+def compare(results, baseline, threshold=1.25):
+    """
+    Print each benchmark's time and memory relative to a baseline run.
+
+    Parameters
+    ----------
+    results, baseline : dict
+        Contents of two results files
+    threshold : float
+        Ratio of wall times above which a benchmark counts as a regression
+
+    Returns
+    -------
+    List of (name, scale) pairs that regressed or failed
+    """
+    base = {(r["name"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"{'benchmark':<31} {'time':>8} {'memory':>8} {'payload':>8}")
+    for result in results["results"]:
+        key = (result["name"], result["scale"])
+        old = base.get(key)
+        label = f"{result['name']:<24} x{result['scale']:<5}"
+        if "error" in result:
+            regressions.append(key)
+            print(f"{label} {'n/a':>8}  <-- failed")
+            continue
+        if old is None or "error" in old:
+            print(f"{label} {'n/a':>8}")
+            continue
+        ratios = [result[k] / old[k] if old[k] else float(result[k] == 0)
+                  for k in ["wall_time_s", "peak_rss_mb", "payload_bytes"]]
+        flag = ""
+        if ratios[0] > threshold:
+            regressions.append(key)
+            flag = "  <-- slower"
+        print(f"{label} " + " ".join(f"{r:7.2f}x" for r in ratios) + flag)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--scales", type=int, nargs="+",
+                            default=[1, 10, 100])
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS),
+                            default=list(BENCHMARKS),
+                            help="Benchmarks to run (default: all)")
+    run_parser.add_argument("--repeat", type=int, default=1)
+    run_parser.add_argument("--workdir", default=None,
+                            help="Where to keep generated data sets")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--baseline", default=None,
+                            help="Results file to compare against")
+    run_parser.add_argument("--threshold", type=float, default=1.25)
+
+    cmp_parser = commands.add_parser("compare",
+                                     help="Compare two results files")
+    cmp_parser.add_argument("results")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        workdir = args.workdir or tempfile.mkdtemp(prefix="app_benchmarks_")
+        os.makedirs(workdir, exist_ok=True)
+        try:
+            results = {"environment": environment(),
+                       "results": run(args.only, args.scales,
+                                      os.path.abspath(workdir), args.repeat)}
+        finally:
+            if args.workdir is None:
+                shutil.rmtree(workdir, ignore_errors=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results written to {args.output}")
+        failed = [r for r in results["results"] if "error" in r]
+        if args.baseline is None:
+            return 1 if failed else 0
+        baseline_path = args.baseline
+    else:
+        with open(args.results) as f:
+            results = json.load(f)
+        baseline_path = args.baseline
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    return 1 if compare(results, baseline, args.threshold) else 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,441 @@
+"""
+Synthetic stand-ins for the data sets the example apps use, so the apps can
+be tested and benchmarked at any scale without the Kaggle download.
+
+Rows are generated in chunks with vectorized numpy, so 100 million rows only
+ever need one chunk in memory at a time. To write a data set to disk:
+
+    python synthetic_data.py weather --rows 100000000 --output weatherAUS.csv
+    python synthetic_data.py wine --rows 10000000 --format npy --output wine
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+from sklearn.datasets import load_wine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CITIES_PATH = os.path.join(ROOT, "Machine_Learning", "WeatherData",
+                           "australian_cities.json")
+sys.path.append(os.path.join(ROOT, "Data_Exploration"))
+
+# Rows in the original data sets, i.e. scale 1
+WEATHER_ROWS = 142_193
+WINE_ROWS = 178
+
+# Each weather station reports consecutive days from FIRST_DAY. When that
+# would take more than MAX_STATION_DAYS, copies of the stations are added
+# instead (e.g. "Albury_2"), so (Location, Date) stays unique.
+FIRST_DAY = "2008-12-01"
+MAX_STATION_DAYS = 33_000  # up to 2099
+
+# Consecutive compass points, as in clean_aus_weather.py
+DIRECTIONS = ["E", "ENE", "NE", "NNE", "N", "NNW", "NW", "WNW",
+              "W", "WSW", "SW", "SSW", "S", "SSE", "SE", "ESE"]
+
+WEATHER_COLUMNS = ["Date", "Location", "MinTemp", "MaxTemp", "Rainfall",
+                   "Evaporation", "Sunshine", "WindGustDir", "WindGustSpeed",
+                   "WindDir9am", "WindDir3pm", "WindSpeed9am", "WindSpeed3pm",
+                   "Humidity9am", "Humidity3pm", "Pressure9am", "Pressure3pm",
+                   "Cloud9am", "Cloud3pm", "Temp9am", "Temp3pm", "RainToday",
+                   "RISK_MM", "RainTomorrow"]
+
+# Share of stations that never report a group of columns, and the share of
+# remaining rows where each column is missing (roughly as in weatherAUS.csv)
+STATION_MISSING = {"Evaporation": 0.35, "Sunshine": 0.4, "Cloud": 0.3,
+                   "Pressure": 0.1, "WindGust": 0.05}
+ROW_MISSING = {"MinTemp": 0.005, "MaxTemp": 0.003, "Rainfall": 0.01,
+               "Evaporation": 0.1, "Sunshine": 0.12, "WindGust": 0.02,
+               "WindDir9am": 0.07, "WindDir3pm": 0.025,
+               "WindSpeed9am": 0.01, "WindSpeed3pm": 0.02,
+               "Humidity9am": 0.012, "Humidity3pm": 0.025,
+               "Pressure9am": 0.01, "Pressure3pm": 0.01,
+               "Cloud9am": 0.1, "Cloud3pm": 0.13,
+               "Temp9am": 0.006, "Temp3pm": 0.02}
+# 9am/3pm readings share instruments, so they tend to go missing together
+PAIRED = ["WindDir", "WindSpeed", "Humidity", "Pressure", "Cloud", "Temp"]
+
+
+
+### Weather
+def stations(n_rows):
+    """
+    Names and coordinates of the stations for n_rows of weather: the cities
+    in australian_cities.json, plus numbered copies of them if each city
+    alone would need more than MAX_STATION_DAYS days.
+
+    Returns
+    -------
+    pandas DataFrame indexed by station name, with latitude and longitude,
+    in the format of australian_cities.json
+    """
+    cities = pd.read_json(CITIES_PATH, orient="index")
+    copies = max(1, -(-n_rows // (len(cities) * MAX_STATION_DAYS)))
+    return pd.concat([cities] + [cities.rename(index=lambda name:
+                      f"{name}_{k}") for k in range(2, copies + 1)])
+
+
+def station_climates(n_rows, seed=101):
+    """
+    Per-station climate parameters, derived from each station's latitude
+    plus a little station-to-station variation.
+
+    Returns
+    -------
+    pandas DataFrame indexed by station name
+    """
+    rng = np.random.default_rng([seed, 0])
+    cities = stations(n_rows).astype(float)
+    lat = cities["latitude"].to_numpy()
+    n = len(cities)
+
+    climate = pd.DataFrame(index=cities.index)
+    # ~28C average in the tropical north down to ~13C in Tasmania
+    climate["mean_temp"] = 28 + 0.49 * (lat + 12.4) + rng.normal(0, 1, n)
+    climate["seasonal_amp"] = 3 + 0.15 * (np.abs(lat) - 12)
+    climate["wetness"] = rng.normal(-0.45, 0.25, n)
+    climate["prevailing_wind"] = rng.integers(0, 16, n)
+    climate["wind"] = rng.uniform(0.8, 1.2, n)
+    for group, share in STATION_MISSING.items():
+        climate[f"no_{group}"] = rng.random(n) < share
+    return climate
+
+
+def _weather_rows(rows, n_rows, climate, rng, state):
+    """
+    Generate the given global row numbers. Rows are laid out station by
+    station, each station a run of consecutive days, like weatherAUS.csv.
+    `state` carries the day-to-day weather persistence between chunks.
+    Also returns the rainfall and which rows are their station's last day.
+    """
+    n = len(rows)
+    per_station = -(-n_rows // len(climate))
+    days = pd.date_range(FIRST_DAY, periods=per_station, freq="D")
+    station = np.minimum(rows // per_station, len(climate) - 1)
+    day = rows - station * per_station
+    date = days.values[day]
+    last_day = (day == per_station - 1) | (rows == n_rows - 1)
+    day_of_year = pd.DatetimeIndex(date).dayofyear.to_numpy()
+    season = np.cos(2 * np.pi * (day_of_year - 15) / 365.25)
+    c = {col: climate[col].to_numpy()[station] for col in climate.columns}
+
+    # Wet spells last a few days: an AR(1) latent weather state, started
+    # afresh on each station's first day
+    shocks = rng.standard_normal(n)
+    wet = np.empty(n)
+    bounds = np.append(np.flatnonzero(np.diff(station, prepend=-1)), n)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if day[start] == 0:
+            state["zi"] = np.zeros(1)
+        wet[start:stop], state["zi"] = lfilter([1.0], [1.0, -0.7],
+            shocks[start:stop], zi=state["zi"])
+    wet = wet / 1.4 + c["wetness"]
+    raining = wet > 0.35
+    drizzle = rng.random(n) < 0.15
+    rain = np.where(raining, 1 + rng.exponential(5, n),
+                    np.where(drizzle, rng.uniform(0, 1, n), 0.0)).round(1)
+
+    noise = lambda scale=1.0: rng.normal(0, scale, n)
+    min_temp = c["mean_temp"] - 5.5 + c["seasonal_amp"] * season \
+               + 0.8 * wet + noise(2.5)
+    max_temp = min_temp + np.clip(11 - 3 * raining + noise(2), 1, None)
+    hum9 = np.clip(70 + 10 * wet - 5 * season + noise(12), 5, 100)
+    cloud9 = np.clip(np.round(4.4 + 2.2 * wet + noise(2)), 0, 8)
+    cloud3 = np.clip(np.round(0.6 * cloud9 + 0.4 * (4.5 + 2.2 * wet)
+                              + noise(1.5)), 0, 8)
+    pressure9 = 1017.5 - 4 * season - 3 * wet + noise(5)
+    gust = np.clip(c["wind"] * rng.gamma(6, 6.7, n) + 5 * wet, 6, 135)
+    dir9 = (c["prevailing_wind"] + np.round(noise(3))).astype(int) % 16
+    dir3 = (dir9 + np.round(noise(2))).astype(int) % 16
+    gust_dir = (dir3 + np.round(noise(1.5))).astype(int) % 16
+    directions = lambda codes: pd.Categorical.from_codes(codes, DIRECTIONS)
+
+    df = pd.DataFrame({
+        "Date": date,
+        "Location": pd.Categorical.from_codes(station, climate.index),
+        "MinTemp": min_temp.round(1),
+        "MaxTemp": max_temp.round(1),
+        "Rainfall": rain,
+        "Evaporation": np.clip(0.25 * max_temp - 1 + rng.gamma(2, 1, n)
+                               - raining, 0, None).round(1),
+        "Sunshine": np.clip(12.5 * (1 - (cloud9 + cloud3) / 18)
+                            + 1.5 * season + noise(1), 0, 14.5).round(1),
+        "WindGustDir": directions(gust_dir),
+        "WindGustSpeed": np.round(gust / 2) * 2,
+        "WindDir9am": directions(dir9),
+        "WindDir3pm": directions(dir3),
+        "WindSpeed9am": np.clip(np.round(0.3 * gust + noise(4)), 0, None),
+        "WindSpeed3pm": np.clip(np.round(0.45 * gust + noise(4)), 0, None),
+        "Humidity9am": hum9.round(),
+        "Humidity3pm": np.clip(hum9 - 19 + 6 * wet + noise(10), 1,
+                               100).round(),
+        "Pressure9am": pressure9.round(1),
+        "Pressure3pm": (pressure9 - 2.5 + noise(1.5)).round(1),
+        "Cloud9am": cloud9,
+        "Cloud3pm": cloud3,
+        "Temp9am": (min_temp + 0.45 * (max_temp - min_temp)
+                    + noise()).round(1),
+        "Temp3pm": (max_temp - 0.7 - np.abs(noise(0.8))).round(1),
+        "RainToday": pd.Categorical.from_codes((rain > 1).astype(int),
+                                               ["No", "Yes"]),
+    })
+
+    # Missing values: whole stations without an instrument, then paired
+    # 9am/3pm readings that drop out together, then single readings
+    for group in STATION_MISSING:
+        cols = [col for col in df.columns if col.startswith(group)]
+        df.loc[c[f"no_{group}"], cols] = np.nan
+    for group in PAIRED:
+        u = rng.random(n)
+        for col in [f"{group}9am", f"{group}3pm"]:
+            df.loc[u < ROW_MISSING[col], col] = np.nan
+    singles = [col for col in ROW_MISSING if col[-3:] not in ["9am", "3pm"]]
+    for name in singles:
+        cols = [col for col in df.columns if col.startswith(name)]
+        df.loc[rng.random(n) < ROW_MISSING[name], cols] = np.nan
+    df.loc[df["Rainfall"].isna(), "RainToday"] = np.nan
+    return df, rain, last_day
+
+
+def _set_tomorrow(df, rain, last_day, next_rain):
+    """
+    Fill RISK_MM and RainTomorrow from the following day's rainfall. A
+    station's last day has no following day, so they are missing there.
+    """
+    risk = np.append(rain[1:], next_rain)
+    risk[last_day] = np.nan
+    df["RISK_MM"] = risk
+    codes = np.where(last_day, -1, (risk > 1).astype(int))
+    df["RainTomorrow"] = pd.Categorical.from_codes(codes, ["No", "Yes"])
+    return df[WEATHER_COLUMNS]
+
+
+def weather_aus_chunks(n_rows, chunk_rows=1_000_000, seed=101):
+    """
+    Generate rows with the columns of Kaggle's weatherAUS.csv, one chunk at
+    a time. The output is the same for a given seed and chunk size.
+
+    Parameters
+    ----------
+    n_rows : integer
+    chunk_rows : integer
+    seed : integer
+
+    Yields
+    ------
+    pandas DataFrame
+    """
+    climate = station_climates(n_rows, seed)
+    state = {"zi": np.zeros(1)}
+    pending = None
+    for i, start in enumerate(range(0, n_rows, chunk_rows)):
+        rng = np.random.default_rng([seed, 1, i])
+        rows = np.arange(start, min(start + chunk_rows, n_rows))
+        chunk = _weather_rows(rows, n_rows, climate, rng, state)
+        if pending is not None:
+            yield _set_tomorrow(*pending, chunk[1][0])
+        pending = chunk
+    if pending is not None:
+        yield _set_tomorrow(*pending, np.nan)
+
+
+def weather_aus(n_rows, seed=101):
+    """ All n_rows of `weather_aus_chunks` as one DataFrame """
+    return pd.concat(weather_aus_chunks(n_rows, seed=seed),
+                     ignore_index=True)
+
+
+def cleaned_weather(n_rows, seed=101):
+    """
+    Generate rows with the columns of cleaned_weather.csv, as written by
+    clean_aus_weather.py. The script's rules for dropping rows and columns
+    are applied as they are, but the gaps left are filled with column
+    medians rather than interpolated, which is much faster at scale.
+
+    Parameters
+    ----------
+    n_rows : integer
+    seed : integer
+
+    Returns
+    -------
+    pandas DataFrame
+    """
+    raw = weather_aus(n_rows, seed)
+    # The script's thresholds count the raw file's rows and columns
+    df = (raw.drop(columns="RISK_MM")
+             .dropna(subset=["Location", "RainToday", "RainTomorrow"])
+             .dropna(thresh=int(0.75 * len(raw.columns)), axis="index")
+             .dropna(thresh=int(0.75 * len(raw)), axis="columns"))
+    # Columns some station never reports are dropped everywhere
+    all_missing = df.isna().groupby(df["Location"], observed=True).all()
+    df = df.drop(columns=all_missing.columns[all_missing.any()])
+
+    dir_to_rad = {d: i * np.pi / 8 for i, d in enumerate(DIRECTIONS)}
+    for col in ["WindGustDir", "WindDir9am", "WindDir3pm"]:
+        if col in df:
+            df[col] = df[col].map(dir_to_rad).astype(float)
+    df = df.fillna(df.median(numeric_only=True))
+    df["RainToday"] = df["RainToday"] == "Yes"
+    df["RainTomorrow"] = df["RainTomorrow"] == "Yes"
+    df["DayOfYear"] = df["Date"].dt.dayofyear
+
+    return (df.drop(columns="Date")
+              .merge(stations(n_rows), left_on="Location", right_index=True, how="left")
+              .drop(columns="Location")
+              .reset_index(drop=True))
+
+
+
+### Wine
+def wine_chunks(n_rows, chunk_rows=1_000_000, seed=101):
+    """
+    Generate rows with the columns of the sklearn wine data set, one chunk
+    at a time. Each class is drawn from a multivariate normal fit to that
+    class, so the features keep their correlations, then clipped to the
+    observed range and rounded like the original.
+
+    Parameters
+    ----------
+    n_rows : integer
+    chunk_rows : integer
+    seed : integer
+
+    Yields
+    ------
+    pandas DataFrame
+    """
+    real = load_wine(as_frame=True).frame
+    features = real.columns.drop("target")
+    classes = np.sort(real["target"].unique())
+    weights = real["target"].value_counts(normalize=True)[classes].to_numpy()
+    means = np.stack([real.loc[real.target == k, features].mean()
+                      for k in classes])
+    chols = np.stack([np.linalg.cholesky(real.loc[real.target == k,
+                      features].cov().to_numpy()) for k in classes])
+    low = real[features].min().to_numpy()
+    high = real[features].max().to_numpy()
+    decimals = [0 if (real[col] % 1 == 0).all() else 2 for col in features]
+
+    for i, start in enumerate(range(0, n_rows, chunk_rows)):
+        rng = np.random.default_rng([seed, 3, i])
+        n = min(chunk_rows, n_rows - start)
+        target = rng.choice(classes, size=n, p=weights)
+        z = rng.standard_normal((n, len(features)))
+        values = np.empty_like(z)
+        for k in classes:
+            rows = target == k
+            values[rows] = means[k] + z[rows] @ chols[k].T
+        values = np.clip(values, low, high)
+        df = pd.DataFrame({col: values[:, j].round(decimals[j])
+                           for j, col in enumerate(features)},
+                          index=pd.RangeIndex(start, start + n))
+        df["target"] = target
+        yield df
+
+
+def wine(n_rows, seed=101):
+    """ All n_rows of `wine_chunks` as one DataFrame """
+    return pd.concat(wine_chunks(n_rows, seed=seed))
+
+
+
+### Writing to disk
+def write_csv(chunks, path):
+    """
+    Write chunks to one CSV file. Uses pyarrow's CSV writer when it is
+    installed, which is several times faster than pandas at this size.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(path, mode="w" if i == 0 else "a",
+                         header=(i == 0), index=False)
+        return
+
+    with open(path, "wb") as f:
+        for i, chunk in enumerate(chunks):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            # Write dates without a time and categories as plain text
+            schema = pa.schema([
+                pa.field(fd.name, pa.date32()) if pa.types.is_timestamp(fd.type)
+                else pa.field(fd.name, pa.string())
+                if pa.types.is_dictionary(fd.type) else fd
+                for fd in table.schema])
+            options = pa_csv.WriteOptions(include_header=(i == 0))
+            pa_csv.write_csv(table.cast(schema), f, options)
+
+
+def write_parquet(chunks, path):
+    """ Write chunks as row groups of one parquet file (needs pyarrow) """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Writing parquet files requires pyarrow: "
+                          "pip install pyarrow")
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+
+def write_npy(chunks, path, n_rows):
+    """
+    Write chunks as a directory of memory-mappable .npy column files, the
+    format the wine explorer's MemmapSource reads. Text columns are stored
+    as fixed-width byte strings.
+    """
+    from DataSources import write_columns
+    longest = max([len(d) for d in DIRECTIONS]
+                  + [len(s) for s in stations(n_rows).index])
+    dtypes = {col: f"S{longest}" for col in
+              ["Location", "WindGustDir", "WindDir9am", "WindDir3pm",
+               "RainToday", "RainTomorrow"]}
+    write_columns(chunks, path, n_rows, dtypes=dtypes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("dataset", choices=["weather", "wine"])
+    parser.add_argument("--rows", type=int, default=None,
+                        help="Number of rows (default: the original size)")
+    parser.add_argument("--format", choices=["csv", "parquet", "npy"],
+                        default="csv")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=101)
+    parser.add_argument("--cities", default=None,
+                        help="Also write the weather stations' coordinates "
+                             "here, for clean_aus_weather.py")
+    args = parser.parse_args()
+
+    if args.dataset == "weather":
+        n_rows = args.rows or WEATHER_ROWS
+        chunks = weather_aus_chunks(n_rows, args.chunk_rows, args.seed)
+        if args.cities:
+            stations(n_rows).to_json(args.cities, orient="index", indent=4)
+    else:
+        n_rows = args.rows or WINE_ROWS
+        chunks = wine_chunks(n_rows, args.chunk_rows, args.seed)
+
+    if args.format == "csv":
+        write_csv(chunks, args.output)
+    elif args.format == "parquet":
+        write_parquet(chunks, args.output)
+    else:
+        write_npy(chunks, args.output, n_rows)
+    print(f"Wrote {n_rows} {args.dataset} rows to {args.output}")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 """
-
+Altair charts for the wine data explorer.
 """
-import altair as alt
+import pandas as pd
 
 
 def get_target_colors(clrs):
@@ -10,19 +10,19 @@ def get_target_colors(clrs):
 
 
 
-def create_grouped_kde(df, col, target=None, by_class=True, size=175,
-                       ylabel=None, xlabel=None):
+def create_grouped_kde(dist, col, by_class=True, size=175, ylabel=None,
+                       xlabel=None):
     """ 
-    Create an altair chart showing the kernel density estimate of a variable 
-    with the option to plot a separate distribution by each class. 
+    Create an altair chart showing the estimated density of a variable with 
+    the option to plot a separate distribution by each class. 
     
     Parameters 
     ----------
-    df : pandas DataFrame 
+    dist : pandas DataFrame 
+        Pre-binned densities with "variable", "target", "value" and 
+        "density" columns, as returned by `DataSource.distributions` 
     col : string
-        The column of df to be plotted 
-    target : string
-        The column of df that holds target labels 
+        The variable to be plotted 
     by_class : boolean, default True 
         Whether to plot data by class 
     size : integer 
@@ -34,32 +34,29 @@ def create_grouped_kde(df, col, target=None, by_class=True, size=175,
     -------
     Altair chart 
     """
+    import altair as alt
     ylabel = ylabel if ylabel is not None else "density"
     xlabel = xlabel if xlabel is not None else col
     
-    labels = df[target].unique()
+    df = dist[dist["variable"] == col]
+    labels = sorted(df["target"].unique())
     
     if by_class:
-        chart = alt.Chart(df, title=col).transform_density(
-            density=col, counts=True, groupby=[target],
-            steps=len(df), extent=[df[col].min() * 0.8,
-            df[col].max() * 1.2], as_=[col, "density"]
-        ).mark_area(
+        df = df.rename(columns={"value": col})
+        chart = alt.Chart(df, title=col).mark_area(
             opacity=0.7, 
             line=alt.OverlayMarkDef(stroke="black", strokeWidth=3)
         ).encode(
             x=alt.X(f"{col}:Q", title=xlabel),
             y=alt.Y("density:Q", title=ylabel),
-            color=alt.Color(f"{target}:N", scale=alt.Scale(domain=labels,
+            color=alt.Color("target:N", scale=alt.Scale(domain=labels,
                             range=get_target_colors(labels)), 
                             legend=alt.Legend(title="Wine classification"))
         )
     else:    
-        chart = alt.Chart(df, title=col).transform_density(
-            density=col, counts=True, steps=len(df),
-            extent=[df[col].min() * 0.8, df[col].max() * 1.2],
-            as_=[col, "density"]
-        ).mark_area(
+        df = (df.groupby("value", as_index=False)["density"].sum()
+                .rename(columns={"value": col}))
+        chart = alt.Chart(df, title=col).mark_area(
             opacity=0.7, 
             line=alt.OverlayMarkDef(stroke="black", strokeWidth=3)
         ).encode(
@@ -70,14 +67,18 @@ def create_grouped_kde(df, col, target=None, by_class=True, size=175,
     return chart.properties(width=size, height=size)
 
 
-def create_distribution_figure(df, by_class, size=175):
+def create_distribution_figure(dist, class_counts, by_class, size=175):
     """ 
-    Create an altair chart for each column in a dataframe. Optionally, plot 
+    Create an altair chart for each variable in a set of pre-binned 
+    distributions, plus a bar chart of the class counts. Optionally, plot 
     distribution by a target class. 
     
     Parameters 
     ----------
-    df : pandas DataFrame 
+    dist : pandas DataFrame 
+        Pre-binned densities, as returned by `DataSource.distributions` 
+    class_counts : pandas Series 
+        Number of rows in each class 
     by_class : boolean
         Whether to plot data by class 
     size : integer 
@@ -87,19 +88,20 @@ def create_distribution_figure(df, by_class, size=175):
     -------
     Altair chart 
     """
-    plot_rows = alt.vconcat(data=df)
+    import altair as alt
+    plot_rows = alt.vconcat()
     n_cols = 3
-    n_rows = (len(df.columns) - 1) // n_cols + 1
+    columns = list(dist["variable"].unique()) + ["target"]
+    target_labels = list(class_counts.index)
 
-    for i in range(0, len(df.columns), n_cols):
-        current_row = df.columns[i: i+n_cols]
+    for i in range(0, len(columns), n_cols):
+        current_row = columns[i: i+n_cols]
         plot_cols = alt.hconcat()
-        target_labels = df.target.unique()
         
         for df_col in current_row:
             if df_col == "target":
-                trg = df.target.value_counts().reset_index().rename(
-                            columns={"target": "count", "index": "label"})
+                trg = pd.DataFrame({"label": target_labels, 
+                                    "count": class_counts.to_numpy()})
                 cht = alt.Chart(trg).mark_bar(stroke="black", 
                     strokeWidth=3).encode(
                           x=alt.X("label:O", title="target"), 
@@ -112,7 +114,7 @@ def create_distribution_figure(df, by_class, size=175):
                       ).properties(width=size, height=size, title="target")
                 plot_cols |= cht 
             else:
-                plot_cols |= create_grouped_kde(df, df_col, "target", by_class,
+                plot_cols |= create_grouped_kde(dist, df_col, by_class,
                                                 size=size)
         plot_rows &= plot_cols
     chart = plot_rows.configure_legend(
@@ -123,7 +125,7 @@ def create_distribution_figure(df, by_class, size=175):
     return chart
 
 
-def create_comparison_figure(df, cols, by_class, size=100):
+def create_comparison_figure(df, dist, cols, by_class, size=100):
     """ 
     Create an altair chart that compairs up to 4 variables pairwise (immitates
     seaborn's pairplot).
@@ -131,6 +133,10 @@ def create_comparison_figure(df, cols, by_class, size=100):
     Parameters 
     ----------
     df : pandas DataFrame 
+        A sample of rows to draw in the scatter plots 
+    dist : pandas DataFrame 
+        Pre-binned densities for the diagonal, as returned by 
+        `DataSource.distributions` 
     cols : list
         The columns of df to be plotted 
     by_class : boolean, default True 
@@ -142,8 +148,9 @@ def create_comparison_figure(df, cols, by_class, size=100):
     -------
     Altair chart 
     """
+    import altair as alt
     plot_rows = alt.vconcat(data=df)
-    labels = df["target"].unique()
+    labels = sorted(df["target"].unique())
     plot_colors = alt.Color(f"target:N", scale=alt.Scale(domain=labels,
                                 range=get_target_colors(labels)))
     for i, col in enumerate(cols):
@@ -152,7 +159,7 @@ def create_comparison_figure(df, cols, by_class, size=100):
             ylabel = col if j == 0 else ""
             xlabel =  secondary if i == len(cols) - 1 else ""
             if secondary == col:
-                cht = create_grouped_kde(df, col, "target", by_class=by_class,
+                cht = create_grouped_kde(dist, col, by_class=by_class,
                                          size=size, ylabel=ylabel,
                                          xlabel=xlabel)
                 cht = cht.properties(title="")
@@ -175,20 +182,22 @@ def create_comparison_figure(df, cols, by_class, size=100):
     return chart
 
 
-def create_corrolation_plot(data):
+def create_corrolation_plot(corr):
     """ 
     Create an altair chart that lists the correlation between variables and is 
     colored according to value. 
     
     Parameters 
     ----------
-    data : pandas DataFrame 
+    corr : pandas DataFrame 
+        Correlation matrix, as returned by `DataSource.correlation` 
     
     Returns 
     -------
     Altair chart 
     """
-    corr = data.corr().reset_index().melt(id_vars="index")
+    import altair as alt
+    corr = corr.rename_axis("index").reset_index().melt(id_vars="index")
     corr.columns = ["Variable 1", "Variable 2", "corr_values"]
     corr["Correlation"] = corr.corr_values.round(3)
     
@@ -0,0 +1,400 @@
+"""
+Data sources for the wine data explorer.
+
+The explorer only needs a few summaries of its data: the rows on display,
+column ranges for the filter widgets, a correlation matrix and binned
+distributions for the plots. A data source builds each of those chunk by
+chunk, so the same app can run on the sklearn wine set held in memory or on
+memory-mapped column files that are much larger than RAM.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+
+### Base class
+class DataSource:
+    """
+    Base class for explorer data sources. Subclasses set `columns` and
+    `n_rows` and implement `read`; every summary is built on top of it. The
+    class label column is always called "target", which the app's plots and
+    table styling rely on.
+    """
+    target = "target"
+    chunk_rows = 1_000_000
+    description = ""
+
+    def __init__(self):
+        self._stats = {}
+        self._labels = None
+
+    def read(self, columns, start, stop):
+        """ Return rows [start, stop) of the given columns as a DataFrame """
+        raise NotImplementedError
+
+    def take(self, rows, columns=None):
+        """
+        Return the given rows, in that order, indexed by row position.
+        Subclasses can override this with something faster than reading
+        the rows one at a time.
+        """
+        columns = self.columns if columns is None else list(columns)
+        if len(rows) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.concat([self.read(columns, r, r + 1) for r in rows])
+
+    def iter_chunks(self, columns=None, mask=None):
+        """
+        Iterate over the data in chunks of at most `chunk_rows` rows.
+
+        Parameters
+        ----------
+        columns : list, optional
+            The columns to read, defaults to all columns
+        mask : numpy array, optional
+            Boolean row mask; only rows where it is True are yielded
+
+        Yields
+        ------
+        DataFrame indexed by global row position
+        """
+        columns = self.columns if columns is None else list(columns)
+        for start in range(0, self.n_rows, self.chunk_rows):
+            stop = min(start + self.chunk_rows, self.n_rows)
+            if mask is not None and not mask[start:stop].any():
+                continue
+            chunk = self.read(columns, start, stop)
+            if mask is not None:
+                chunk = chunk[mask[start:stop]]
+            yield chunk
+
+    def count(self, mask=None):
+        """ Number of rows selected by mask """
+        return self.n_rows if mask is None else int(mask.sum())
+
+    def column_stats(self, col):
+        """
+        Minimum, maximum and mode of a column as Python scalars. The mode is
+        taken from the first chunk so it never needs a full pass of counts.
+        """
+        if col not in self._stats:
+            lows, highs, mode = [], [], None
+            for chunk in self.iter_chunks([col]):
+                if mode is None:
+                    mode = chunk[col].mode()[0]
+                lows.append(chunk[col].min())
+                highs.append(chunk[col].max())
+            self._stats[col] = {"min": np.min(lows).item(),
+                                "max": np.max(highs).item(),
+                                "mode": np.asarray(mode).item()}
+        return self._stats[col]
+
+    def class_labels(self):
+        """ Sorted unique values of the target column """
+        if self._labels is None:
+            self._labels = self.class_counts().index.tolist()
+        return self._labels
+
+    def class_counts(self, mask=None):
+        """ Number of rows in each class """
+        counts = [chunk[self.target].value_counts() for chunk
+                  in self.iter_chunks([self.target], mask)]
+        if not counts:
+            return pd.Series(dtype=int, name="count")
+        total = pd.concat(counts).groupby(level=0).sum().sort_index()
+        return total.rename("count")
+
+    def apply_filters(self, filters, mask=None):
+        """
+        Evaluate filters chunk by chunk.
+
+        Parameters
+        ----------
+        filters : dict
+            Maps a column to a filter dictionary of "<", ">" and "==" bounds,
+            as built by the explorer's filter widgets
+        mask : numpy array, optional
+            A previous boolean row mask to narrow down further
+
+        Returns
+        -------
+        Boolean numpy array with one entry per row
+        """
+        new_mask = (np.ones(self.n_rows, dtype=bool) if mask is None
+                    else mask.copy())
+        bounds = {col: get_bounds(fd) for col, fd in filters.items()}
+        bounds = {col: b for col, b in bounds.items() if b}
+        if not bounds:
+            return new_mask
+
+        for start in range(0, self.n_rows, self.chunk_rows):
+            stop = min(start + self.chunk_rows, self.n_rows)
+            keep = new_mask[start:stop]
+            if not keep.any():
+                continue
+            chunk = self.read(list(bounds), start, stop)
+            for col, col_bounds in bounds.items():
+                values = chunk[col].to_numpy()
+                for op, value in col_bounds:
+                    if op == "<":
+                        keep &= values < value
+                    elif op == ">":
+                        keep &= values > value
+                    else:
+                        keep &= values == value
+        return new_mask
+
+    def top_n(self, n, mask=None, sort_column=None, ascending=True):
+        """
+        The first n rows, or the n smallest/largest rows of sort_column.
+        Candidates are found by reading only sort_column, keeping at most n
+        of them between chunks; then just the chosen rows are read in full.
+        Ties keep their original order.
+        """
+        if sort_column is None:
+            rows = []
+            for chunk in self.iter_chunks([self.columns[0]], mask):
+                rows.extend(chunk.index[:n - len(rows)])
+                if len(rows) >= n:
+                    break
+            return self.take(rows)
+
+        best = None
+        for chunk in self.iter_chunks([sort_column], mask):
+            values = chunk[sort_column]
+            if best is not None:
+                values = pd.concat([best, values])
+            best = (values.nsmallest(n) if ascending
+                    else values.nlargest(n))
+        if best is None:
+            return pd.DataFrame(columns=self.columns)
+        return self.take(best.index.to_numpy())
+
+    def correlation(self, mask=None, columns=None):
+        """
+        Pearson correlation matrix built from running sums over the chunks.
+        Rows with missing values are skipped.
+        """
+        columns = self.columns if columns is None else list(columns)
+        n, shift, sums, cross = 0, None, 0.0, 0.0
+        for chunk in self.iter_chunks(columns, mask):
+            values = chunk.dropna().to_numpy(dtype=np.float64)
+            if not len(values):
+                continue
+            # Shift by the first chunk's mean to keep the sums well scaled
+            if shift is None:
+                shift = values.mean(axis=0)
+            values = values - shift
+            n += len(values)
+            sums = sums + values.sum(axis=0)
+            cross = cross + values.T @ values
+        if n < 2:
+            return pd.DataFrame(np.nan, index=columns, columns=columns)
+        mean = sums / n
+        cov = (cross - n * np.outer(mean, mean)) / (n - 1)
+        std = np.sqrt(np.diag(cov))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = cov / np.outer(std, std)
+        return pd.DataFrame(np.clip(corr, -1, 1), index=columns,
+                            columns=columns)
+
+    def distributions(self, columns=None, mask=None, bins=60, smooth=1.5):
+        """
+        Smoothed per-class histograms of each column, as a stand-in for a
+        kernel density estimate over the raw rows.
+
+        Parameters
+        ----------
+        columns : list, optional
+            The columns to bin, defaults to all but the target
+        mask : numpy array, optional
+            Boolean row mask
+        bins : integer
+            Number of bins per column
+        smooth : float
+            Width, in bins, of the Gaussian used to smooth the counts
+
+        Returns
+        -------
+        Long DataFrame with "variable", "target", "value" and "density"
+        columns. The density is scaled by the row count, like altair's
+        `transform_density(counts=True)`.
+        """
+        if columns is None:
+            columns = [c for c in self.columns if c != self.target]
+        labels = self.class_labels()
+        label_idx = {label: i for i, label in enumerate(labels)}
+        edges = {}
+        for col in columns:
+            stats = self.column_stats(col)
+            edges[col] = np.linspace(stats["min"] * 0.8, stats["max"] * 1.2,
+                                     bins + 1)
+        counts = {col: np.zeros(len(labels) * bins) for col in columns}
+
+        for chunk in self.iter_chunks(columns + [self.target], mask):
+            classes = chunk[self.target].map(label_idx).to_numpy()
+            for col in columns:
+                values = chunk[col].to_numpy()
+                bin_idx = np.searchsorted(edges[col], values, "right") - 1
+                ok = (bin_idx >= 0) & (bin_idx < bins)
+                counts[col] += np.bincount(classes[ok] * bins + bin_idx[ok],
+                                           minlength=len(labels) * bins)
+
+        offsets = np.arange(-int(3 * smooth) - 1, int(3 * smooth) + 2)
+        kernel = np.exp(-0.5 * (offsets / smooth) ** 2)
+        kernel /= kernel.sum()
+        frames = []
+        for col in columns:
+            width = edges[col][1] - edges[col][0]
+            centers = (edges[col][:-1] + edges[col][1:]) / 2
+            for label, col_counts in zip(labels,
+                                         counts[col].reshape(-1, bins)):
+                density = np.convolve(col_counts, kernel, mode="same")
+                frames.append(pd.DataFrame({"variable": col, "target": label,
+                                            "value": centers,
+                                            "density": density / width}))
+        return pd.concat(frames, ignore_index=True)
+
+    def sample(self, n, columns=None, mask=None, seed=101):
+        """ About n randomly chosen rows, drawn chunk by chunk """
+        total = self.count(mask)
+        rate = 1.0 if total <= n else n / total
+        rng = np.random.default_rng(seed)
+        parts = [chunk if rate == 1.0 else chunk[rng.random(len(chunk)) < rate]
+                 for chunk in self.iter_chunks(columns, mask)]
+        if not parts:
+            return pd.DataFrame(columns=columns or self.columns)
+        return pd.concat(parts).head(n)
+
+
+
+### Implementations
+class InMemorySource(DataSource):
+    """ A data source over a pandas DataFrame """
+
+    def __init__(self, df, description=""):
+        super().__init__()
+        self.df = df.reset_index(drop=True)
+        self.columns = list(df.columns)
+        self.n_rows = len(df)
+        self.description = description
+
+    def read(self, columns, start, stop):
+        # Rows and columns in one step, so only the chunk is copied
+        return self.df.iloc[start:stop, self.df.columns.get_indexer(columns)]
+
+    def take(self, rows, columns=None):
+        columns = self.columns if columns is None else list(columns)
+        return self.df.iloc[np.asarray(rows, dtype=int),
+                            self.df.columns.get_indexer(columns)]
+
+
+class MemmapSource(DataSource):
+    """
+    A data source over a directory of column files, as written by
+    `write_columns`. Each column is a .npy file that gets memory-mapped, so
+    only the chunk currently being summarized is paged into memory. The
+    schema's class label column is renamed to "target".
+    """
+
+    def __init__(self, path, chunk_rows=None):
+        super().__init__()
+        with open(os.path.join(path, "schema.json")) as f:
+            schema = json.load(f)
+        self.path = path
+        label = schema.get("target", self.target)
+        if label != self.target and self.target in schema["columns"]:
+            raise ValueError(f"Class column is {label!r} but there is "
+                             f"another column called {self.target!r}")
+        names = {col: self.target if col == label else col
+                 for col in schema["columns"]}
+        self.columns = list(names.values())
+        self.n_rows = schema["n_rows"]
+        self.description = schema.get("description", "")
+        if chunk_rows is not None:
+            self.chunk_rows = chunk_rows
+        self.arrays = {names[col]: np.load(os.path.join(path, file),
+                                           mmap_mode="r")
+                       for col, file in schema["files"].items()}
+
+    def read(self, columns, start, stop):
+        return pd.DataFrame({col: np.asarray(self.arrays[col][start:stop])
+                             for col in columns},
+                            index=pd.RangeIndex(start, stop))
+
+    def take(self, rows, columns=None):
+        # Fancy indexing a memmap only pages in the chosen rows
+        columns = self.columns if columns is None else list(columns)
+        rows = np.asarray(rows, dtype=np.int64)
+        return pd.DataFrame({col: self.arrays[col][rows] for col in columns},
+                            index=rows)
+
+
+
+### Other Functions
+def get_bounds(filter_dict):
+    """
+    The (operator, value) pairs set in a filter dictionary. Matches what
+    `get_filter_expression` in the app displays: unset or zero bounds are
+    ignored and values are rounded to 2 decimal places.
+    """
+    return [(k, round(v, 2)) for k, v in filter_dict.items()
+            if v and k != "active"]
+
+
+def write_columns(frames, path, n_rows, target="target", description="",
+                  dtypes=None):
+    """
+    Write DataFrames to a directory of .npy column files readable by
+    MemmapSource. Frames are written one at a time, so the full data set
+    never has to be in memory.
+
+    Parameters
+    ----------
+    frames : iterable of pandas DataFrames
+        Consecutive chunks of rows, all with the same columns and dtypes
+    path : string
+        Directory to write to (created if needed)
+    n_rows : integer
+        Total number of rows across all frames
+    target : string
+        Name of the class label column; MemmapSource renames it "target"
+    description : string
+        Text shown in the explorer's "Data Description" section
+    dtypes : dict, optional
+        File dtypes for some columns, e.g. "S16" to store text columns as
+        fixed-width byte strings (missing values become empty strings)
+    """
+    dtypes = dtypes or {}
+    os.makedirs(path, exist_ok=True)
+    arrays, written = None, 0
+    for frame in frames:
+        if arrays is None:
+            # Column names can contain characters like "/", so number files
+            files = {col: f"{i:03d}.npy" for i, col in enumerate(frame.columns)}
+            arrays = {col: np.lib.format.open_memmap(
+                          os.path.join(path, files[col]), mode="w+",
+                          dtype=dtypes.get(col, frame[col].dtype),
+                          shape=(n_rows,))
+                      for col in frame.columns}
+        if written + len(frame) > n_rows:
+            raise ValueError(f"Frames contain more than {n_rows} rows")
+        for col, arr in arrays.items():
+            values = frame[col]
+            if arr.dtype.kind == "S":
+                values = values.astype(object).fillna("")
+            arr[written: written + len(frame)] = values.to_numpy()
+        written += len(frame)
+    if arrays is None:
+        raise ValueError("No frames to write")
+    if written != n_rows:
+        raise ValueError(f"Expected {n_rows} rows but got {written}")
+    for arr in arrays.values():
+        arr.flush()
+
+    schema = {"columns": list(arrays), "files": files, "n_rows": n_rows,
+              "target": target, "description": description}
+    with open(os.path.join(path, "schema.json"), "w") as f:
+        json.dump(schema, f, indent=4)
@@ -1,14 +1,24 @@
 """
 This is an example of using Streamlit for data exploration.
-It uses the built-in sklearn wine data set.
+It uses the built-in sklearn wine data set, or any data set written with
+DataSources.write_columns (set WINE_DATA_DIR to its directory).
 """
 
 ### Imports
+import os
+import sys
 import streamlit as st
 import pandas as pd
-from sklearn.datasets import load_wine
+import numpy as np
 
 from AppPlotFunctions import *
+from DataSources import InMemorySource, MemmapSource
+
+# Shared helpers live at the top of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AppInstrumentation import (session_recorder, stage, timed, show_panel,
+                                DEBUG_PANEL)
+from AppCaching import cached, file_key, mask_digest
 
 
 
@@ -22,10 +32,12 @@ def main():
     ### Configure the page 
     st.set_page_config(page_title="Explore Wine Data", page_icon="🍷",
                        layout="wide")
+    timings = session_recorder()
+    timings.start_rerun()
     
     ### Load the data
-    data = load_data()
-    data_cols = list(data.columns)
+    source = load_data()
+    data_cols = list(source.columns)
 
     ### Set up our app layout
     # Main page title: HTML formatting
@@ -40,7 +52,7 @@ def main():
     distribution_plot = st.beta_expander("Distribution Plot", expanded=True)
     comparison_plot = st.beta_expander("Comparison Plot", expanded=True)
     description = st.beta_expander("Data Description", expanded=False)
-    description.write(return_description())
+    description.write(source.description)
 
     # Sidebar: use containers
     display_options = st.sidebar.beta_container()
@@ -59,7 +71,7 @@ def main():
     ascending = sort_cont[1].selectbox(" ­­", ["Low->High", "High->Low"],
                                        key="sort_how")
     num_rows = display_options.number_input("Number of Rows to Display", 1,
-                                            data.shape[0], 5)
+                                            source.n_rows, 5)
     plot_options.title("Plotting Options")
     by_class = plot_options.checkbox("Show distribution by class", True)
     plot_filtered = plot_options.checkbox("Plot filtered data", True)
@@ -80,8 +92,9 @@ def main():
     filter_cols = filter_container.beta_columns([2, 1, 1])
     col_filter = filter_cols[0].selectbox("", data_cols)
     filter_exp = filter_cols[1].selectbox("", ["<", "==", ">"], index=2)
-    filter_num = filter_cols[2].number_input("", data[col_filter].min(),
-                    data[col_filter].max(), data[col_filter].mode()[0])
+    stats = source.column_stats(col_filter)
+    filter_num = filter_cols[2].number_input("", stats["min"], stats["max"],
+                                             stats["mode"])
     add_filter = filter_container.button("Add filter")
 
     current_filters = filter_container.beta_columns(2)
@@ -92,11 +105,10 @@ def main():
     active_text = current_filters[1].empty()
     rm_filters = current_filters[1].button("Remove all filters")
 
-    # Retrieve all set filters and the previously filtered frame
+    # Retrieve all set filters and the previous filter mask (None is all rows)
     active_filters = get_filters()
     filtered_data = get_filtered_data()
-    filtered =  (filtered_data["data"] if filtered_data["data"] is not None
-                 else data.copy())
+    mask, digest = filtered_data["mask"], filtered_data["digest"]
 
     # Add new filter button
     if add_filter:
@@ -111,17 +123,18 @@ def main():
 
     # Apply filters button
     if apply_filters:
-        queries = []
-        for col, filter_dict in active_filters.items():
-            queries.append(get_filter_expression(filter_dict, col))
+        for col in active_filters:
             active_filters[col].update({"active": True})
-        if queries:
-            filtered = filtered.query(" & ".join(queries))
+        if active_filters:
+            with stage("filter"):
+                mask = source.apply_filters(active_filters, mask)
+                digest = mask_digest(mask)
 
     # Remove filters button
     if rm_filters:
         active_filters.clear()  # clears the cache
-        filtered = data.copy()
+        mask = None
+        digest = mask_digest(mask)
 
     # Display what filters have been "staged" and which ones are "active"
     staged_text.markdown("\---")
@@ -138,42 +151,66 @@ def main():
         if active:
             active_text.markdown("  \n".join(active))
 
-    # Cache the newly filtered frame
-    filtered_data.update({"data": filtered})
+    # Cache the new filter mask
+    filtered_data.update({"mask": mask, "digest": digest})
 
     # Display the filtered & styled data
-    Style.num_rows = num_rows
     Style.colored = True if colr_data else False
-    Style.sort_column = sort_col
-    Style.ascending = True if ascending == "Low->High" else False
-    data_container.write(f"Dataframe contains {filtered.shape[0]} data points")
-    # data_container.table(Style().style(filtered))
-    data_container.table(Style().style(filtered))
-
-    # Plots
-    plot_df = filtered if plot_filtered else data
-    corrolation_map.altair_chart(create_corrolation_plot(plot_df),
-                                 use_container_width=True)
-    distribution_plot.altair_chart(create_distribution_figure(plot_df,
-                                                              by_class))
-    compare_cols = [v for v in plot_vars if v != "---"]
-    if compare_cols:
-        comparison_plot.altair_chart(create_comparison_figure(plot_df,
-                                     compare_cols, by_class, size=120))
+    sort_by = None if sort_col == "---" else sort_col
+    table_html = get_styled_table(source, mask, digest, num_rows, sort_by,
+                                  ascending == "Low->High")
+    data_container.write(f"Dataframe contains {source.count(mask)} data "
+                         "points")
+    data_container.markdown(table_html, unsafe_allow_html=True)
+
+    # Plots: built from summaries of the data rather than the raw rows
+    plot_mask = mask if plot_filtered else None
+    summaries = get_summaries(source, plot_mask,
+                              digest if plot_filtered else mask_digest(None))
+    with stage("charts"):
+        corrolation_map.altair_chart(create_corrolation_plot(
+                                     summaries["correlation"]),
+                                     use_container_width=True)
+        distribution_plot.altair_chart(create_distribution_figure(
+                                       summaries["distributions"],
+                                       summaries["class_counts"], by_class))
+        compare_cols = [v for v in plot_vars if v != "---"]
+        if compare_cols:
+            sample = source.sample(2000, compare_cols + [source.target],
+                                   plot_mask)
+            comparison_plot.altair_chart(create_comparison_figure(sample,
+                                         summaries["distributions"],
+                                         compare_cols, by_class, size=120))
+
+    if DEBUG_PANEL:
+        show_panel(timings, st.sidebar)
 
 
 
 ### Cached functions
-@st.cache(allow_output_mutation=True)
+def get_data_key():
+    """ Cache key of the data source: its schema file, or the sklearn data """
+    data_dir = os.environ.get("WINE_DATA_DIR")
+    if data_dir:
+        return file_key(os.path.join(data_dir, "schema.json"))
+    return ("sklearn", "wine")
+
+@timed()
+@cached("wine_source", key=get_data_key, max_mb=512)
 def load_data():
-    """ Load and shuffle the sklearn wine data set. """
-    data = load_wine(as_frame=True).frame
-    return data.sample(frac=1, replace=False,
-                       random_state=101).reset_index(drop=True)
-
-@st.cache(allow_output_mutation=True)
-def return_description():
-    return load_wine().DESCR[19:]
+    """
+    Open the data source. If WINE_DATA_DIR is set, memory-map the column
+    files in that directory. Otherwise load and shuffle the sklearn wine data
+    set.
+    """
+    data_dir = os.environ.get("WINE_DATA_DIR")
+    if data_dir:
+        return MemmapSource(data_dir)
+    from sklearn.datasets import load_wine
+    wine = load_wine(as_frame=True)
+    data = wine.frame.sample(frac=1, replace=False,
+                             random_state=101).reset_index(drop=True)
+    return InMemorySource(data, wine.DESCR[19:])
 
 @st.cache(allow_output_mutation=True)
 def get_plot_vars():
@@ -185,7 +222,20 @@ def get_filters():
 
 @st.cache(allow_output_mutation=True)
 def get_filtered_data():
-    return {"data": None}
+    return {"mask": None, "digest": mask_digest(None)}
+
+def prewarm():
+    """
+    Open the data, compute the plot aggregates and style the default table,
+    see prewarm_and_run.py
+    """
+    import altair  # loaded now rather than on the first render
+    source = load_data()
+    get_filtered_data()
+    get_filters()
+    get_plot_vars()
+    get_summaries(source, None, mask_digest(None))
+    get_styled_table(source, None, mask_digest(None), 5, None, True)
 
 
 ### Other Functions
@@ -206,6 +256,33 @@ def get_filter_update(subdict, filter_exp, filter_num):
             subdict[other] = None
     return subdict
 
+@timed()
+@cached("wine_summaries", max_mb=64,
+        key=lambda source, mask, digest: (get_data_key(), digest))
+def get_summaries(source, mask, digest):
+    """
+    Get the aggregates the plots are built from. They are computed once per
+    filter mask, cached by the mask's digest.
+    """
+    return {"correlation": source.correlation(mask),
+            "distributions": source.distributions(mask=mask),
+            "class_counts": source.class_counts(mask)}
+
+@timed()
+@cached("wine_tables", max_mb=16,
+        key=lambda source, mask, digest, *options: (get_data_key(), digest,
+                                                    *options, Style.colored))
+def get_styled_table(source, mask, digest, num_rows, sort_by, ascending):
+    """
+    Get the HTML of the styled table for the current filter mask. Tables are
+    cached by the mask's digest and the display options, so reruns that don't
+    change them skip sorting and styling.
+    """
+    top_rows = source.top_n(num_rows, mask, sort_by, ascending=ascending)
+    styled = Style().style(top_rows)
+    return (styled.to_html() if hasattr(styled, "to_html")
+            else styled.render())
+
 def get_filter_expression(filter_dict, col):
     """ Get the expresion for the filter """
     defined = [k for k, v in filter_dict.items() if v and k!="active"]
@@ -215,31 +292,29 @@ def get_filter_expression(filter_dict, col):
 
 ### Style class to display dataframe
 class Style:
-    num_rows = 3
     colored = False
-    sort_column = "---"
-    ascending = True
-
-    def color_class(self, row):
-        """ Color each row according to it's target variable """
-        colors = ["DarkMagenta", "MediumOrchid", "RebeccaPurple"]
-        return [f"background-color: {colors[int(row.target)]}"]*len(row)
-
+    colors = ["DarkMagenta", "MediumOrchid", "RebeccaPurple"]
+
+    def color_classes(self, df):
+        """
+        Get the CSS for the whole table in one step: look up each row's
+        class color by its target value and broadcast it across the columns
+        """
+        if Style.colored:
+            lookup = np.array([f"background-color: {c}; color: white"
+                               for c in Style.colors])
+            css = lookup[df["target"].to_numpy(dtype=int)]
+        else:
+            css = np.full(len(df), "color: black")
+        return pd.DataFrame(np.broadcast_to(css[:, None], df.shape),
+                            index=df.index, columns=df.columns)
 
     def style(self, df):
         """ Apply all the styles to a dataframe df """
         ### Change Style
         # Display 2 decimal places
-        if Style.sort_column != "---":
-            df = df.sort_values(by=Style.sort_column,
-                                ascending=Style.ascending)
-        st_df = df.head(Style.num_rows).style.set_precision(2)
-        font_color = "black"
-        if Style.colored == True:
-            st_df = st_df.apply(self.color_class, axis="columns")
-            font_color = "white"
-
-        return st_df.set_properties(**{"color": font_color})
+        st_df = df.style.set_precision(2)
+        return st_df.apply(self.color_classes, axis=None)
 
 
 
@@ -247,4 +322,7 @@ if __name__ == "__main__":
     ### Set the color palette
     colors = ["DarkMagenta", "MediumOrchid", "RebeccaPurple", "DarkOrchid",
               "DarkViolet", "BlueViolet", "Indigo", "MediumPurple", "Purple"]
-    main()
+    if os.environ.get("APP_PREWARM"):
+        prewarm()
+    else:
+        main()
@@ -0,0 +1,308 @@
+"""
+Model training, scoring and feature importance for the weather prediction
+app. The functions that run in worker processes live here rather than in the
+app's script, so the workers can import them.
+"""
+import numpy as np
+import pandas as pd
+
+# The sidebar's hyperparameters that a histogram model uses, see make_model
+HIST_PARAMETERS = ["n_estimators", "max_depth", "class_weight",
+                   "random_state"]
+
+
+def score(y, y_hat):
+    """
+    Score hard predictions the way the app reports them.
+
+    Returns
+    -------
+    dictionary of "f1 score", "accuracy" and "AUC"
+    """
+    from sklearn import metrics
+    fpr, tpr, _ = metrics.roc_curve(y, y_hat)
+    return {"f1 score": metrics.f1_score(y, y_hat),
+            "accuracy": metrics.accuracy_score(y, y_hat),
+            "AUC": metrics.auc(fpr, tpr)}
+
+
+
+def make_folds(y, n_folds, seed):
+    """
+    Stratified k-fold (train, test) index arrays for the rows of y. int32
+    keeps them small enough to send to the workers as they are.
+    """
+    from sklearn.model_selection import StratifiedKFold
+    folds = StratifiedKFold(n_folds, shuffle=True, random_state=seed)
+    return [(trn.astype(np.int32), tst.astype(np.int32)) for trn, tst
+            in folds.split(np.zeros(len(y)), y)]
+
+
+def used_parameters(parameters, model_type="forest"):
+    """
+    The hyperparameters that make a difference to a model of this type, so
+    models differing only in ones it ignores share a cache key.
+    """
+    if model_type == "hist":
+        return {k: v for k, v in parameters.items() if k in HIST_PARAMETERS}
+    return parameters
+
+
+def make_model(parameters, model_type="forest"):
+    """
+    An unfit model of the given type with the sidebar's hyperparameters.
+
+    "forest" is a RandomForestClassifier. "hist" is a
+    HistGradientBoostingClassifier, which bins its features again on each
+    fit: the number of trees becomes the number of boosting iterations, the
+    depth and class weight carry over, and the split options don't apply.
+    """
+    if model_type == "forest":
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(**parameters)
+    try:
+        from sklearn.ensemble import HistGradientBoostingClassifier
+    except ImportError:  # scikit-learn < 1.0
+        from sklearn.experimental import enable_hist_gradient_boosting
+        from sklearn.ensemble import HistGradientBoostingClassifier
+    hist_parameters = {"max_iter": parameters["n_estimators"],
+                       "max_depth": parameters["max_depth"],
+                       "early_stopping": False,
+                       "random_state": parameters["random_state"]}
+    if parameters["class_weight"] is not None:
+        if "class_weight" not in HistGradientBoostingClassifier().get_params():
+            raise ValueError("Class weights for histogram boosting need "
+                             "scikit-learn 1.2 or later")
+        hist_parameters["class_weight"] = parameters["class_weight"]
+    return HistGradientBoostingClassifier(**hist_parameters)
+
+
+def _fit_fold(parameters, model_type, X, y, fold):
+    """ Fit on one fold's training rows and score its held-out rows """
+    train_idx, test_idx = fold
+    model = make_model(parameters, model_type)
+    model.fit(X[train_idx], y[train_idx])
+    return score(y[test_idx], model.predict(X[test_idx]))
+
+
+def _fit_all(parameters, model_type, X, y, feature_names):
+    """ Fit on every training row, keeping any column names for predict """
+    model = make_model(parameters, model_type)
+    if feature_names is not None:
+        X = pd.DataFrame(X, columns=feature_names, copy=False)
+    return model.fit(X, y)
+
+
+def cross_validate(parameters, X, y, folds, model_type="forest", n_jobs=-1):
+    """
+    Fit a model on each fold, and one on all of X, in parallel.
+
+    The folds and the final fit are independent, so they all go to one
+    process pool and take about as long as a single fit when there are
+    enough cores. joblib memory-maps X and y for the workers instead of
+    pickling a copy for each task; only the fold indices are sent.
+
+    Parameters
+    ----------
+    parameters : dictionary
+        RandomForestClassifier arguments
+    X : pandas DataFrame or numpy array
+        Training features, e.g. the binned array from `FeatureBinner`
+    y : pandas Series
+        Training labels
+    folds : list of (train, test) index arrays
+        As returned by `make_folds`
+    model_type : string
+        "forest" or "hist", see `make_model`
+    n_jobs : integer
+        Number of worker processes, -1 for one per core
+
+    Returns
+    -------
+    model : the model fit on all of X
+    fold_scores : pandas DataFrame with one row of `score` per fold
+    """
+    from joblib import Parallel, delayed
+    if isinstance(X, pd.DataFrame):
+        features = X.to_numpy(dtype=np.float32)  # the trees split on float32
+        names = list(X.columns)
+    else:
+        features, names = X, None
+    labels = y.to_numpy()
+    tasks = [delayed(_fit_all)(parameters, model_type, features, labels,
+                               names)]
+    tasks += [delayed(_fit_fold)(parameters, model_type, features, labels,
+                                 fold) for fold in folds]
+    results = Parallel(n_jobs=n_jobs, backend="loky", mmap_mode="r")(tasks)
+    index = pd.RangeIndex(1, len(folds) + 1, name="fold")
+    return results[0], pd.DataFrame(results[1:], index=index)
+
+
+
+class FeatureBinner:
+    """
+    Quantize each feature into at most `max_bins` quantile bins, stored as
+    uint8 codes. Codes keep the features' order, so trees split on them the
+    same way as on the binned values. Missing values get their own code,
+    max_bins.
+
+    The codes take an eighth of the memory of float64 only while they sit
+    in the cache or are memory-mapped for the workers. scikit-learn converts
+    them back to float64 and bins them again on every fit, in each worker
+    too, so a fit still makes its own full-size copy; binning 256 distinct
+    values per feature is just quicker than binning the raw ones.
+
+    Parameters
+    ----------
+    max_bins : integer
+        At most 255, so the missing value code fits in a uint8
+    subsample : integer
+        Number of rows the quantiles are estimated from
+    seed : integer
+    """
+
+    def __init__(self, max_bins=255, subsample=200_000, seed=101):
+        self.max_bins = max_bins
+        self.subsample = subsample
+        self.seed = seed
+
+    def fit(self, X):
+        """ Find each feature's bin edges """
+        X = np.asarray(X, dtype=np.float64)
+        if len(X) > self.subsample:
+            rng = np.random.default_rng(self.seed)
+            X = X[rng.choice(len(X), self.subsample, replace=False)]
+        quantiles = np.linspace(0, 100, self.max_bins + 1)[1:-1]
+        self.edges_ = []
+        for col in X.T:
+            col = col[~np.isnan(col)]
+            values = np.unique(col)
+            if len(values) <= self.max_bins:
+                # Few enough values for one bin each: split between them
+                edges = (values[:-1] + values[1:]) / 2
+            else:
+                edges = np.unique(np.percentile(col, quantiles))
+            self.edges_.append(edges)
+        return self
+
+    def transform(self, X):
+        """ Bin codes of X as a uint8 array """
+        if isinstance(X, pd.DataFrame):
+            X = X.to_numpy(dtype=np.float64)
+        binned = np.empty(X.shape, dtype=np.uint8)
+        for j, edges in enumerate(self.edges_):
+            col = X[:, j].astype(np.float64, copy=False)
+            binned[:, j] = np.searchsorted(edges, col, side="right")
+            binned[np.isnan(col), j] = self.max_bins
+        return binned
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def __repr__(self):
+        return f"FeatureBinner(max_bins={self.max_bins})"
+
+
+
+class BinnedModel:
+    """
+    A model fit on binned features that bins new data before predicting, so
+    it can be used like a model fit on the raw features.
+    """
+
+    def __init__(self, binner, model):
+        self.binner = binner
+        self.model = model
+
+    def predict(self, X):
+        return self.model.predict(self.binner.transform(X))
+
+    def predict_proba(self, X):
+        return self.model.predict_proba(self.binner.transform(X))
+
+    def __repr__(self):
+        return f"{self.model!r} on {self.binner!r}"
+
+
+
+def predict_proba(model, X, batch_rows=65536):
+    """
+    Probability of the positive class, predicted batch_rows at a time so the
+    trees' intermediate arrays stay small. X is a float32 array in the
+    model's column order.
+    """
+    names = getattr(model, "feature_names_in_", None)
+    proba = np.empty(len(X))
+    for start in range(0, len(X), batch_rows):
+        batch = X[start:start + batch_rows]
+        if names is not None:
+            batch = pd.DataFrame(batch, columns=names, copy=False)
+        proba[start:start + batch_rows] = model.predict_proba(batch)[:, 1]
+    return proba
+
+
+def _permute_columns(model, X, y, columns, n_repeats, seed, baseline):
+    """
+    Importance of a group of columns. The rows are copied once into a
+    buffer; each column is then shuffled in place from X and put back.
+    """
+    from sklearn.metrics import roc_auc_score
+    buffer = np.array(X, dtype=np.float32)
+    drops = {}
+    for col in columns:
+        # Seeded by column so the results don't depend on the grouping
+        rng = np.random.default_rng([seed, col])
+        drops[col] = []
+        for _ in range(n_repeats):
+            buffer[:, col] = X[rng.permutation(len(X)), col]
+            permuted = roc_auc_score(y, predict_proba(model, buffer))
+            drops[col].append(baseline - permuted)
+        buffer[:, col] = X[:, col]
+    return drops
+
+
+def permutation_importance(model, X, y, n_repeats=5, seed=101, n_jobs=-1):
+    """
+    How much the model's ROC AUC drops when each feature is shuffled.
+
+    The features are split into one group per worker process. Each worker
+    shuffles its columns in a single preallocated copy of X, reading the
+    original values from a shared memory-mapped X.
+
+    Parameters
+    ----------
+    model : fitted classifier with predict_proba
+    X : pandas DataFrame
+        Features to score on, usually held-out data
+    y : pandas Series
+    n_repeats : integer
+        Number of shuffles per feature
+    seed : integer
+    n_jobs : integer
+        Number of worker processes, -1 for one per core
+
+    Returns
+    -------
+    pandas DataFrame with the mean ("importance") and standard deviation
+    ("std") of the drop for each feature, most important first
+    """
+    from joblib import Parallel, delayed, effective_n_jobs
+    from sklearn.metrics import roc_auc_score
+    features = X.to_numpy(dtype=np.float32)
+    labels = y.to_numpy()
+    baseline = roc_auc_score(labels, predict_proba(model, features))
+
+    n_groups = min(effective_n_jobs(n_jobs), features.shape[1])
+    groups = np.array_split(np.arange(features.shape[1]), n_groups)
+    results = Parallel(n_jobs=n_jobs, backend="loky", mmap_mode="r")(
+        delayed(_permute_columns)(model, features, labels, group.tolist(),
+                                  n_repeats, seed, baseline)
+        for group in groups)
+
+    drops = {X.columns[col]: d for result in results
+             for col, d in result.items()}
+    importance = pd.DataFrame({"importance": [np.mean(d) for d in
+                                              drops.values()],
+                               "std": [np.std(d) for d in drops.values()]},
+                              index=list(drops))
+    return importance.sort_values("importance", ascending=False)
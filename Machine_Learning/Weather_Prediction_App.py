@@ -6,11 +6,30 @@ It uses the Australian Rain data set from Kaggle to train random forests.
 ### Imports
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn import metrics
+import sys
+
+# Shared helpers live at the top of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AppInstrumentation import (session_recorder, stage, timed, show_panel,
+                                DEBUG_PANEL)
+from AppCaching import cached, get_cache, file_key, params_key
+from AppModelFunctions import (score, make_folds, make_model, cross_validate,
+                               used_parameters, permutation_importance,
+                               FeatureBinner, BinnedModel)
 SEED = 101
+DATA_PATH = os.path.join("WeatherData", "cleaned_weather.csv")
+# Memory budgets (MB) for the loaded data and for the trained models
+DATA_CACHE_MB = 2048
+# Model types in the sidebar, see AppModelFunctions.make_model
+MODEL_TYPES = {"Random Forest": "forest",
+               "Histogram Boosting (pre-binned)": "hist"}
+MODEL_CACHE_MB = 1024
+# The hyperparameters the sidebar starts with
+DEFAULT_PARAMETERS = {"n_estimators": 150, "max_depth": 7,
+                      "min_samples_split": 2, "max_features": "sqrt",
+                      "class_weight": None, "random_state": SEED}
 
 
 def main():
@@ -19,19 +38,28 @@ def main():
     called from the terminal. It contains all the layout information and
     executes the appropriate computations.
     """
+    timings = session_recorder()
+    timings.start_rerun()
+
     ### Set up our side bar
     st.sidebar.title("Model Hyperparameters")
     help_button = st.sidebar.button(label="Help")
+    model_label = st.sidebar.radio(label="Model Type",
+                                   options=list(MODEL_TYPES), index=0)
     n_trees = st.sidebar.number_input(label="Number of Trees in Forest",
-                                      min_value=1, max_value=None, value=150)
+        min_value=1, max_value=None,
+        value=DEFAULT_PARAMETERS["n_estimators"])
     max_depth = st.sidebar.slider(label="Maximum Tree Depth", min_value=1,
-                                  max_value=30, value=7)
+        max_value=30, value=DEFAULT_PARAMETERS["max_depth"])
     min_split = st.sidebar.selectbox(label="Minimum Samples Per Split",
                                      options=list(range(2, 11)), index=0)
     max_features = st.sidebar.radio(label="Feature Split Type",
                                     options=["Square Root", "Log (Base 2)",
                                     "All Features"], index=0)
     balanced = st.sidebar.checkbox(label="Balance Class Weight", value=False)
+    n_folds = st.sidebar.selectbox(label="Cross-Validation",
+        options=[1, 3, 5, 10], index=0,
+        format_func=lambda k: "Off" if k == 1 else f"{k} folds")
     start_button = st.sidebar.button(label="Train Model")
 
 
@@ -50,6 +78,7 @@ def main():
     data = load_data()  
     cached = cached_values()
     model_dict = get_models()    
+    trained_models = get_cache("weather_models", MODEL_CACHE_MB)
     
     # Add in placeholders
     close_help_spot = st.empty()
@@ -73,8 +102,9 @@ def main():
         L = len(cached["display_data"]) + 1
         cached["display_data"] = pd.concat([data["y_train"].head(L),
             data["X_train"].head(L)], axis=1).reset_index(drop=True)
-    sty_df = cached["display_data"].style.set_precision(2)
-    table_spot.table(sty_df)
+    with stage("data table"):
+        sty_df = cached["display_data"].style.set_precision(2)
+        table_spot.table(sty_df)
 
     # Add help information for hyperparameters 
     close_help = close_help_spot.button("Close")
@@ -98,31 +128,52 @@ def main():
                       "max_features": mxf_dict[max_features], 
                       "class_weight": "balanced" if balanced else None,
                       "random_state": SEED}
-        model_name = "_".join([f"{k}={v}" for k, v in parameters.items()])
+        model_type = MODEL_TYPES[model_label]
+        parameters = used_parameters(parameters, model_type)
+        model_key = get_model_key(parameters, n_folds, model_type)
         
-        if not model_name in model_dict:
-            # Train and cache the model
-            with st.spinner("Training Random Forest Model..."):
-                model = RandomForestClassifier(**parameters)
-                model.fit(data["X_train"], data["y_train"])
+        if not model_key in trained_models:
+            # Train and cache the model, unless it was trained at startup
+            trained = get_prewarmed_models().pop(model_key, None)
+            if trained is None:
+                with st.spinner(f"Training {model_label} Model..."):
+                    try:
+                        trained = train_model(parameters, data, n_folds,
+                                              model_type)
+                    except ValueError as e:
+                        st.error(e)
+                        st.stop()
+            model = trained["model"]
             model_dict["current_model"] = model 
-            model_dict[model_name] = {"model": model, "parameters": parameters}
+            model_dict["current_key"] = model_key
+            trained_models.put(model_key, {"model": model,
+                                           "parameters": parameters})
             
-            results, cms = evaluate_model(model, data)
+            results, cms = trained["results"], trained["confusions"]
             cached["performance"]["metrics"] = results
             cached["performance"]["confusions"] = cms
             current_metrics = {"Train F1": results["Train"]["f1 score"],
                                "Test F1": results["Test"]["f1 score"],
                                "Train AUC": results["Train"]["AUC"],
                                "Test AUC": results["Test"]["AUC"]}
+            if "CV Mean" in results:
+                current_metrics.update({
+                    "CV F1": results["CV Mean"]["f1 score"],
+                    "CV F1 Std": results["CV Std"]["f1 score"],
+                    "CV AUC": results["CV Mean"]["AUC"]})
             colname = f"M{len(cached['past_metrics'].columns)+1}"
-            cached["past_metrics"].insert(0, colname, 
-                pd.Series({**current_metrics, **parameters}))
+            unused = {k: "n/a" for k in DEFAULT_PARAMETERS
+                      if k not in parameters}
+            cached["past_metrics"].insert(0, colname, pd.Series(
+                {**current_metrics, "model": model_label, **unused,
+                 **parameters}))
             
         else:
             # Use the previously trained model as the current model
             st.write("You trained this model before! Retrieving from cache.")
-            model_dict["current_model"] = model_dict[model_name]["model"]
+            retrieved = trained_models.get(model_key)
+            model_dict["current_model"] = retrieved["model"]
+            model_dict["current_key"] = model_key
             
     
     if model_dict["current_model"]:
@@ -151,22 +202,48 @@ def main():
         con2 = cached["performance"]["confusions"][1]
         col2.table(con2)
         col2.markdown(txt[0] if con2.iloc[0][1] < con2.iloc[1][0] else txt[1])
+
+        st.subheader("Feature Importance")
+        st.write("Which weather features does the model rely on?")
+        if st.checkbox("Compute permutation importance"):
+            with st.spinner("Shuffling each feature of the testing data..."):
+                importance = get_importance(model_dict["current_model"],
+                                            model_dict["current_key"], data)
+            st.write("How much the testing AUC (from predicted probabilities) "
+                     "drops when a feature's values are shuffled.")
+            st.bar_chart(importance["importance"])
+            st.table(importance.style.format("{:.4f}"))
         
     # Look at model performances for previously trained models 
     past = st.beta_expander("Trained Model Performances", False)
     if not cached["past_metrics"].empty:
         past.header("You've Trained These Models:")
-        past.dataframe(format_model_df(cached["past_metrics"], 3))
+        n_models = cached["past_metrics"].shape[1]
+        # Style the table once per new model; reruns reuse the HTML, since
+        # st.dataframe would run the styler again every time
+        if cached["past_html"][0] != n_models:
+            styled = format_model_df(cached["past_metrics"], 3)
+            html = (styled.to_html() if hasattr(styled, "to_html")
+                    else styled.render())
+            cached["past_html"] = (n_models, "<div style='overflow-x: auto'>"
+                                             f"{html}</div>")
+        with stage("model table"):
+            past.markdown(cached["past_html"][1], unsafe_allow_html=True)
+
+    if DEBUG_PANEL:
+        show_panel(timings, st.sidebar)
 
 
+@timed()
 def format_model_df(df, precision=3):
     """ Format the data frame containing the previously trained models. """
     def highlight_best(x):
         """ Highlight column with best test F1 score. """
-        x2 = pd.DataFrame(index=x.index, columns=x.columns)
-        max_col = x.loc["Test F1"].astype(float).idxmax()
-        x2[max_col] = "background-color: yellow"
-        return x2.fillna("background-color: white")
+        best = x.columns == x.loc["Test F1"].astype(float).idxmax()
+        css = np.where(best, "background-color: yellow",
+                       "background-color: white")
+        return pd.DataFrame(np.broadcast_to(css, x.shape), index=x.index,
+                            columns=x.columns)
 
     def change_dtypes(df):
         """ Change the type of each row """
@@ -176,13 +253,16 @@ def format_model_df(df, precision=3):
         df_t = df.T.copy()
         for col in df_t.columns:
             if col in int_cols:
-                df_t[col] = df_t[col].astype(int)
+                df_t[col] = df_t[col].map(lambda v: v if isinstance(v, str)
+                                          else int(v))
             # elif col in str_cols:
             #     df_t[col] = df_t[col].astype(object)
             elif col == "max_features":
                 df_t[col].fillna("All", inplace=True)
             elif col == "class_weight":
                 df_t[col].fillna("not", inplace=True)
+            elif col == "model":
+                df_t[col] = df_t[col].astype(str)
             else:
                 df_t[col] = df_t[col].astype(float)
         return df_t.T.copy()
@@ -194,16 +274,16 @@ def format_model_df(df, precision=3):
             
     
     
-@st.cache(persist=True, suppress_st_warning=True, show_spinner=False)
+@timed()
 def load_data():
     """ 
     Load the cleaned weather data from the csv. If the data hasn't been 
     downloaded, prompt a download. If it has been downloaded but not cleaned, 
-    run the cleaning script. 
+    run the cleaning script. The result is cached by the csv's path, size and
+    modification time, so nothing is hashed on a rerun.
     """
     # Load the data from the sklearn package
-    data_path = os.path.join("WeatherData", "cleaned_weather.csv")
-    if not os.path.exists(data_path):
+    if not os.path.exists(DATA_PATH):
         original_path = os.path.join("WeatherData", "weatherAUS.csv")
         if not os.path.exists(original_path):
             st.error("Please download the Australian Weather data from "
@@ -215,14 +295,23 @@ def load_data():
             os.chdir("WeatherData")
             import clean_aus_weather
             os.chdir("..")
+    return read_data(DATA_PATH)
+
+
+@cached("weather_data", key=file_key, max_mb=DATA_CACHE_MB)
+def read_data(data_path):
+    """ Read the cleaned data and split it into training and testing data """
     data = pd.read_csv(data_path)
     y = data.pop("RainTomorrow")
     
-    # Split it into training and testing data
-    X_train, X_test, y_train, y_test = train_test_split(data, y,
-        test_size=0.15, random_state=SEED)
-    data_dict =  {"X_train": X_train, "X_test": X_test, 
-                  "y_train": y_train, "y_test": y_test}
+    # Split it into training and testing data. These are the rows sklearn's
+    # train_test_split(test_size=0.15, random_state=SEED) picks, without
+    # importing sklearn, which the first render doesn't otherwise need
+    order = np.random.RandomState(SEED).permutation(len(data))
+    n_test = int(np.ceil(0.15 * len(data)))
+    train, test = order[n_test:], order[:n_test]
+    data_dict =  {"X_train": data.iloc[train], "X_test": data.iloc[test], 
+                  "y_train": y.iloc[train], "y_test": y.iloc[test]}
     return data_dict
 
     
@@ -232,41 +321,124 @@ def cached_values():
     with open("./raw/help_text.txt") as f:
         help_text = f.readlines()
     metric_idx = ["Train F1", "Test F1", "Train AUC", "Test AUC",
-                  "n_estimators", "max_depth", "min_samples_split",
-                  "max_features", "class_weight"]
+                  "CV F1", "CV F1 Std", "CV AUC", "model", "n_estimators",
+                  "max_depth", "min_samples_split", "max_features",
+                  "class_weight"]
     
     values = {"display_data": None,
               "help_text": "".join(help_text),
               "help_text_state": {"show": False},
               "performance": {"metrics": None, "confusions": None},
               "past_metrics": pd.DataFrame(index=metric_idx),
+              "past_html": (0, None),
               }
     return values
     
     
 @st.cache(persist=True, allow_output_mutation=True)
 def get_models():
-    return {"current_model": None}
+    """ The model being shown; every trained model is in "weather_models" """
+    return {"current_model": None, "current_key": None}
+
+
+@st.cache(allow_output_mutation=True)
+def get_prewarmed_models():
+    """ Models trained by prewarm() that nobody has asked for yet """
+    return {}
+
+
+def prewarm():
+    """
+    Load (and if needed, clean) the data and train a model with the
+    sidebar's default hyperparameters, see prewarm_and_run.py
+    """
+    data = load_data()
+    cached_values()
+    get_models()
+    parameters = dict(DEFAULT_PARAMETERS)
+    get_prewarmed_models()[get_model_key(parameters, 1)] = train_model(
+        parameters, data)
+
+
+def get_model_key(parameters, n_folds, model_type="forest"):
+    """ The key a trained model is cached under """
+    return params_key(parameters) + (("cv_folds", n_folds),
+                                     ("model", model_type))
+
 
+@cached("weather_folds", max_mb=256,
+        key=lambda data, n_folds: (file_key(DATA_PATH), n_folds))
+def get_folds(data, n_folds):
+    """ Cross-validation fold indices of the training data """
+    return make_folds(data["y_train"], n_folds, SEED)
 
 
-def evaluate_model(model, data):
+@timed()
+@cached("weather_bins", max_mb=DATA_CACHE_MB // 4,
+        key=lambda data: file_key(DATA_PATH))
+def get_binned_data(data):
     """
-    Evaluate the random forest model on traning and testing data. 
+    The training features quantized into uint8 bins, computed once and
+    shared by every histogram model trained on the data
     """
+    binner = FeatureBinner(seed=SEED)
+    return {"binner": binner, "X_train": binner.fit_transform(data["X_train"])}
+
+
+def train_model(parameters, data, n_folds=1, model_type="forest"):
+    """
+    Train a model and evaluate it. With more than one fold, the folds are
+    cross-validated in parallel with the fit on all the data. Histogram
+    models are fit on the cached binned features.
+    """
+    X_train = data["X_train"]
+    if model_type == "hist":
+        binned = get_binned_data(data)
+        X_train = binned["X_train"]
+    fold_scores = None
+    with stage("fit"):
+        if n_folds > 1:
+            model, fold_scores = cross_validate(parameters, X_train,
+                data["y_train"], get_folds(data, n_folds), model_type)
+        else:
+            model = make_model(parameters, model_type)
+            model.fit(X_train, data["y_train"])
+    if model_type == "hist":
+        model = BinnedModel(binned["binner"], model)
+    results, cms = evaluate_model(model, data, fold_scores)
+    return {"model": model, "results": results, "confusions": cms}
+
+
+
+@timed()
+@cached("weather_importance", max_mb=64,
+        key=lambda model, model_key, data: model_key)
+def get_importance(model, model_key, data):
+    """
+    Permutation importance of a model on the testing data, cached under the
+    model's key so it's only computed once
+    """
+    return permutation_importance(model, data["X_test"], data["y_test"],
+                                  seed=SEED)
+
+
+@timed()
+def evaluate_model(model, data, fold_scores=None):
+    """
+    Evaluate the random forest model on traning and testing data. If the
+    model was cross-validated, add the mean and spread of its fold scores.
+    """
+    from sklearn import metrics
     y_hat_trn = model.predict(data["X_train"])
     y_hat_tst = model.predict(data["X_test"])
     
     # Custom classification report
-    results = pd.DataFrame(index=["Train", "Test"])
-    results["f1 score"] = [metrics.f1_score(data["y_train"], y_hat_trn),
-                           metrics.f1_score(data["y_test"], y_hat_tst)] 
-    results["accuracy"] = [metrics.accuracy_score(data["y_train"], y_hat_trn),
-                           metrics.accuracy_score(data["y_test"], y_hat_tst)]
-    fpr_trn, tpr_trn, _ = metrics.roc_curve(data["y_train"], y_hat_trn)
-    fpr_tst, tpr_tst, _ = metrics.roc_curve(data["y_test"], y_hat_tst)
-    results["AUC"] = [metrics.auc(fpr_trn, tpr_trn), 
-                      metrics.auc(fpr_tst, tpr_tst)]
+    results = pd.DataFrame([score(data["y_train"], y_hat_trn),
+                            score(data["y_test"], y_hat_tst)],
+                           index=["Train", "Test"])
+    if fold_scores is not None:
+        results.loc["CV Mean"] = fold_scores.mean()
+        results.loc["CV Std"] = fold_scores.std()
     
     # Confusion matrices    
     cols = ["Actually No Rain", "Actually Rain"]
@@ -280,4 +452,7 @@ def evaluate_model(model, data):
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if os.environ.get("APP_PREWARM"):
+        prewarm()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""
+Start one of the example apps with its caches already filled.
+
+    python prewarm_and_run.py Machine_Learning/Weather_Prediction_App.py
+
+The app's script is run once in this process, the way Streamlit runs it,
+but calling its prewarm() function instead of main(). Its data, cleaned data
+and models end up in the same in-memory caches the server uses, and the
+heavy imports are already loaded, so the first visitor doesn't wait for any
+of it. Then the Streamlit server starts as `streamlit run` would. Arguments
+after the script path are passed on to `streamlit run`.
+
+Running an app's script directly with APP_PREWARM=1 also calls prewarm(),
+but in a process of its own; no cache outlives it, so that only helps with
+work written to disk, such as cleaning the weather data.
+"""
+import os
+import sys
+import time
+import types
+
+
+
+def prewarm(script_path):
+    """ Run the app's script as __main__ with APP_PREWARM set """
+    module = types.ModuleType("__main__")
+    module.__file__ = script_path
+    with open(script_path) as f:
+        code = compile(f.read(), script_path, "exec")
+
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = module
+    os.environ["APP_PREWARM"] = "1"
+    try:
+        exec(code, module.__dict__)
+    finally:
+        del os.environ["APP_PREWARM"]
+        sys.modules["__main__"] = main_module
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    script_path = os.path.abspath(sys.argv[1])
+
+    # The apps read their files relative to their own directory
+    os.chdir(os.path.dirname(script_path))
+    sys.path.insert(0, os.path.dirname(script_path))
+
+    start = time.perf_counter()
+    prewarm(script_path)
+    print(f"Caches filled in {time.perf_counter() - start:.1f} s")
+
+    try:
+        from streamlit.web import cli as stcli
+    except ImportError:  # streamlit < 1.12
+        from streamlit import cli as stcli
+    sys.argv = ["streamlit", "run", script_path] + sys.argv[2:]
+    sys.exit(stcli.main())
+
+
+
+if __name__ == "__main__":
+    main()